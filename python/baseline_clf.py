@@ -1,136 +1,310 @@
 """Build a classifier to make the predictions"""
 
 import pandas as pd
+from read import cache_arrays
 import read_pet as pet
 import read_mri as mri
+import read_csf as csf
+import read_clinical as clinical
 import patient_info as pi
+import cross_val as cv
+import metrics
+from patient_store import PatientStore
+import gram_cache
+import scheduler
+import schema
 
 import numpy as np
-from random import shuffle
 import matplotlib.pyplot as plt
 
-from sklearn import cross_validation, svm
+from sklearn import svm
 from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import LabelBinarizer
-from sklearn.metrics import roc_curve, auc
+from sklearn.metrics import roc_curve
 from sklearn.learning_curve import validation_curve
 
 import sys
 
 LABELS = {'NL':1, 'MCI-C':2, 'MCI-NC':3, 'MCI-REV':4, 'AD':5}
 
-def generate_features_fdg_bl(show_stats=False):
+def encode_labels(dx_base):
     """
-    Generate a feature vector for each sample of the fdg data
+    Keyword Arguments:
+    dx_base -- categorical Series of baseline classes
+
+    Returns the numeric LABELS of dx_base (-1 for classes not in LABELS)
+    """
+    codes = np.array([LABELS.get(label, -1)
+                      for label in dx_base.cat.categories])
+    return codes[dx_base.cat.codes.values]
+
+def show_counts(y):
+    """
+    Keyword Arguments:
+    y -- numeric LABELS of the patients
+
+    Print the number of patients in each class
+    """
+    for label, code in LABELS.items():
+        print label, ": ", (y == code).sum()
+
+def report_readings(modality, counts, expected):
+    """
+    Keyword Arguments:
+    modality -- Name of the modality, for the report
+    counts   -- Number of baseline rows found for each patient
+    expected -- Number of rows making up one baseline reading
+
+    Print how many patients have no, or more than one, baseline reading
     """
-    data = pet.FDG
-    # generate feature name
-    data['REGION'] = data['ROINAME'] + data['ROILAT']
+    missing = (counts == 0).sum()
+    extra = (counts > expected).sum()
+    partial = ((counts > 0) & (counts < expected)).sum()
+    if missing or extra or partial:
+        print '%s: %d patients without a baseline reading, '\
+            '%d with more than one, %d incomplete'\
+            %(modality, missing, extra, partial)
+
+@cache_arrays('features_fdg_bl', [pet.FDG_FILE] + pi.DX_FILES)
+def extract_features_fdg_bl(dtype, phase, float32):
+    """
+    Build the (x, y, rid) arrays of generate_features_fdg_bl. float32
+    tells whether the tables hold float32 measures (schema.FLOAT32); it
+    is only part of the cache key.
+    """
+    data = pet.get_fdg()
     # get subjects with baseline data
-    dx_base = pi.get_baseline_classes(data, 'ADNI1')
+    dx_base = pi.get_baseline_classes(data, phase)
     features = ['MEAN', 'MEDIAN', 'MODE', 'MIN', 'MAX', 'STDEV']
-    x = []
-    y = []
-    rid = []
-
-    counts = {}
-    for label in LABELS.keys():
-        counts[label] = 0
-
-    for patient in dx_base.keys():
-        readings = data[(data['RID'] == patient) &
-                        (data['VISCODE'] == 'bl')]
-        if not readings.empty:
-            assert (len(readings) == 5),\
-                'More than one baseline reading for RID=%d'%patient
-            patient_features = readings.pivot(index='RID',
-                                              columns='REGION')\
-                [features].values[0]
-            x.append(patient_features)
-            y.append(LABELS[dx_base[patient]])
-            counts[dx_base[patient]] += 1
-            rid.append(patient)
+    regions = len(data['ROI'].unique())
+
+    # patients with a complete, single baseline reading
+    store = PatientStore(data, visit='VISCODE')
+    counts = store.count(dx_base.index, 'bl')
+    report_readings('FDG', counts, regions)
+    rid = dx_base.index.values[counts == regions]
+
+    readings = store.take(rid, 'bl')
+    readings = readings.set_index([readings['RID'].values,
+                                   (readings['ROINAME'].astype(str) +
+                                    readings['ROILAT'].astype(str)).values])
+    # one row per patient, columns are (feature, region)
+    x = readings[features].unstack().reindex(rid).values
+    y = encode_labels(dx_base.loc[rid])
+
+    return np.ascontiguousarray(x, dtype=dtype), y, rid
+
+def generate_features_fdg_bl(show_stats=False, dtype=np.float64,
+                             phase='ADNI1', use_cache=True):
+    """
+    Generate a feature vector for each sample of the fdg data
 
+    Keyword Arguments:
+    show_stats -- Print the number of patients in each class
+    dtype      -- Type of the feature matrix (np.float32 halves its size)
+    phase      -- Phase passed on to pi.get_baseline_classes
+    use_cache  -- Load the arrays from, or store them in, read.CACHE_DIR
+                  (as read-only memory maps)
+    """
+    x, y, rid = extract_features_fdg_bl(np.dtype(dtype).str, phase,
+                                        schema.FLOAT32, use_cache=use_cache)
     if show_stats:
-        for label, count in counts.items():
-            print label, ": ", count
+        show_counts(y)
 
-    return np.array(x), np.array(y), rid
+    return x, y, rid
 
-def generate_features_mri_bl(show_stats=False):
+@cache_arrays('features_mri_bl', [mri.DATA_FILE] + pi.DX_FILES)
+def extract_features_mri_bl(dtype, phase, qc, normalise, float32):
     """
-    Generate a feature vector for each patient with a baseline MRI scan
+    Build the (x, y, rid) arrays of generate_features_mri_bl (float32 as
+    for extract_features_fdg_bl)
     """
-    data = mri.FSX
-    # use only patients with completed scans and passed quality checks
-    #data = data[(data['STATUS'] == 'complete') & (data['OVERALLQC'] == 'Pass')]
-    # use only patients with completed scans
-    data = data[data['STATUS'] == 'complete']
-    dx_base = pi.get_baseline_classes(data, 'ADNI1')
+    data = mri.get_fsx()
+    if qc:
+        # use only patients with completed scans and passed quality checks
+        data = data[(data['STATUS'] == 'complete') &
+                    (data['OVERALLQC'] == 'Pass')]
+    else:
+        # use only patients with completed scans
+        data = data[data['STATUS'] == 'complete']
+    dx_base = pi.get_baseline_classes(data, phase)
     features = [col for col in data.columns
                 if col[:2] == 'ST' and\
                 not col == 'STATUS' and\
                 ~pd.isnull(data[col]).any()]
-    x = []
-    y = []
-    rid = []
-
-    counts = {}
-    for label in LABELS.keys():
-        counts[label] = 0
-
-    for patient in dx_base.keys():
-        # passively reject more than one scan for the same patient
-        readings = data[(data['RID'] == patient) &
-                        (data['VISCODE'] == 'sc')][:1]
-        if not readings.empty:
-            icv = readings['ST10CV'].values.ravel()[0]
-            assert (len(readings) == 1),\
-                'More than one baseline reading for RID=%d'%patient
-            patient_features = (readings[features]/icv).values[0]
-            x.append(patient_features)
-            y.append(LABELS[dx_base[patient]])
-            counts[dx_base[patient]] += 1
-            rid.append(patient)
 
+    store = PatientStore(data, visit='VISCODE', baseline='sc')
+    counts = store.count(dx_base.index, 'sc')
+    report_readings('MRI', counts, 1)
+    rid = dx_base.index.values[counts > 0]
+
+    # passively reject more than one scan for the same patient
+    readings = store.take(rid, 'sc')
+    readings = readings[~readings['RID'].duplicated().values]
+    x = readings[features].values
+    if normalise:
+        # normalise volumes by the intracranial volume
+        x = x/readings[['ST10CV']].values
+    y = encode_labels(dx_base.loc[rid])
+
+    return np.ascontiguousarray(x, dtype=dtype), y, rid
+
+def generate_features_mri_bl(show_stats=False, dtype=np.float64,
+                             phase='ADNI1', qc=False, normalise=True,
+                             use_cache=True):
+    """
+    Generate a feature vector for each patient with a baseline MRI scan
+
+    Keyword Arguments:
+    show_stats -- Print the number of patients in each class
+    dtype      -- Type of the feature matrix (np.float32 halves its size)
+    phase      -- Phase passed on to pi.get_baseline_classes
+    qc         -- Only use scans that passed the overall quality check
+    normalise  -- Divide the volumes by the intracranial volume
+    use_cache  -- Load the arrays from, or store them in, read.CACHE_DIR
+                  (as read-only memory maps)
+    """
+    x, y, rid = extract_features_mri_bl(np.dtype(dtype).str, phase, qc,
+                                        normalise, schema.FLOAT32,
+                                        use_cache=use_cache)
     if show_stats:
-        for label, count in counts.items():
-            print label, ": ", count
+        show_counts(y)
+
+    return x, y, rid
+
+# AV45 summary measures, normalised by the whole cerebellum
+AV_FEATURES = ['FRONTAL', 'CINGULATE', 'PARIETAL', 'TEMPORAL',
+               'SUMMARYSUVR_WHOLECEREBNORM']
 
-    return np.array(x), np.array(y), rid
+# UPENN CSF biomarkers
+CSF_FEATURES = ['ABETA', 'TAU', 'PTAU']
 
-def generate_features_concat(show_stats=False):
+def generate_features_table(data, features, modality, phase='ADNI1',
+                            show_stats=False, dtype=np.float64):
     """
-    Generate a feature vector that is the concatenation of the two modalities
+    Generate a feature vector for each patient from the first baseline
+    ('bl' VISCODE2) row of a table with one row per visit
+
+    Keyword Arguments:
+    data       -- The table
+    features   -- The columns to use (missing ones are ignored)
+    modality   -- Name of the modality, for the report
+    phase      -- Phase passed on to pi.get_baseline_classes
+    show_stats -- Print the number of patients in each class
+    dtype      -- Type of the feature matrix (np.float32 halves its size)
+    """
+    features = [col for col in features if col in data.columns]
+    dx_base = pi.get_baseline_classes(data, phase)
+
+    store = PatientStore(data)
+    counts = store.count(dx_base.index, 'bl')
+    report_readings(modality, counts, 1)
+
+    readings = store.take(dx_base.index.values[counts > 0], 'bl')
+    readings = readings[~readings['RID'].duplicated().values]
+    x = readings[features].apply(pd.to_numeric, errors='coerce').values
+    # patients with a missing measurement have no usable reading
+    complete = ~np.isnan(x).any(axis=1)
+    x = x[complete]
+    rid = readings['RID'].values[complete]
+
+    y = encode_labels(dx_base.loc[rid])
+    if show_stats:
+        show_counts(y)
+
+    return np.ascontiguousarray(x, dtype=dtype), y, rid
+
+def generate_features_av_bl(show_stats=False, dtype=np.float64):
+    """
+    Generate a feature vector for each patient with a baseline AV45 scan.
+    AV45 imaging started with ADNIGO, so all phases are used.
+    """
+    return generate_features_table(pet.get_av(), AV_FEATURES, 'AV45', '',
+                                   show_stats, dtype)
+
+def generate_features_csf_bl(show_stats=False, dtype=np.float64):
+    """
+    Generate a feature vector for each patient with baseline CSF results
     """
+    return generate_features_table(csf.get_csf(), CSF_FEATURES, 'CSF',
+                                   'ADNI1', show_stats, dtype)
 
-    data_mri = generate_features_mri_bl()
-    data_fdg = generate_features_fdg_bl()
-    common = list(set(data_mri[2]).intersection(data_fdg[2]))
+def generate_features_clinical_bl(show_stats=False, dtype=np.float64):
+    """
+    Generate a feature vector of the baseline MMSE and CDR scores
+    """
+    mmse = generate_features_table(clinical.get_mmse(), ['MMSCORE'], 'MMSE',
+                                   'ADNI1', dtype=dtype)
+    cdr = generate_features_table(clinical.get_cdr(), ['CDGLOBAL'], 'CDR',
+                                  'ADNI1', dtype=dtype)
+    x, y, rid, _, _ = join_features([mmse, cdr])
+    if show_stats:
+        show_counts(y)
 
-    x = []
-    y = []
+    return x, y, rid
 
-    counts = {}
-    for label in LABELS.keys():
-        counts[label] = 0
+def join_features(blocks, how='inner'):
+    """
+    Align the feature blocks of several modalities on the patient RID
 
-    for patient in common:
-        mri_idx = data_mri[2].index(patient)
-        fdg_idx = data_fdg[2].index(patient)
-        x.append(np.r_[data_mri[0][mri_idx], data_fdg[0][fdg_idx]])
-        class_mri = data_mri[1][mri_idx]
-        class_fdg = data_fdg[1][fdg_idx]
-        assert (class_mri == class_fdg), \
+    Keyword Arguments:
+    blocks -- List of (x, y, rid) blocks, as returned by the
+              generate_features_* functions
+    how    -- 'inner' keeps the patients found in every block,
+              'outer' those found in any block
+
+    Returns (x, y, rid, offsets, mask). Columns offsets[i]:offsets[i+1]
+    of x hold block i, and mask[j, i] tells whether patient j has block
+    i. Missing blocks are filled with NaN.
+    """
+    rids = [np.asarray(block[2]) for block in blocks]
+    if how == 'inner':
+        rid = reduce(np.intersect1d, rids)
+    elif how == 'outer':
+        rid = reduce(np.union1d, rids)
+    else:
+        raise ValueError('how must be inner or outer, not %s'%how)
+
+    offsets = np.r_[0, np.cumsum([block[0].shape[1] for block in blocks])]
+    dtype = np.result_type(*[block[0].dtype for block in blocks])
+    x = np.empty((len(rid), offsets[-1]), dtype=dtype)
+    x.fill(np.nan)
+    y = np.empty(len(rid), dtype=int)
+    y.fill(-1)
+    mask = np.zeros((len(rid), len(blocks)), dtype=bool)
+
+    for i, (block_x, block_y, block_rid) in enumerate(blocks):
+        block_rid = np.asarray(block_rid)
+        if not len(block_rid):
+            continue
+        order = np.argsort(block_rid)
+        pos = np.searchsorted(block_rid[order], rid)
+        pos = order[np.minimum(pos, len(block_rid)-1)]
+        found = block_rid[pos] == rid
+
+        x[found, offsets[i]:offsets[i+1]] = block_x[pos[found]]
+        assert ((y[found] == -1) | (y[found] == block_y[pos[found]])).all(),\
             'Error in corresponding labels'
-        y.append(class_fdg)
-        counts[LABELS.keys()[LABELS.values().index(class_fdg)]] += 1
+        y[found] = block_y[pos[found]]
+        mask[:, i] = found
+
+    return x, y, rid, offsets, mask
+
+def generate_features_concat(show_stats=False, use_cache=True):
+    """
+    Generate a feature vector that is the concatenation of the two modalities
+
+    Keyword Arguments:
+    show_stats -- Print the number of patients in each class
+    use_cache  -- Take the blocks of the two modalities from read.CACHE_DIR
+    """
+    x, y, _, _, _ = join_features([
+        generate_features_mri_bl(use_cache=use_cache),
+        generate_features_fdg_bl(use_cache=use_cache)])
 
     if show_stats:
-        for label, count in counts.items():
-            print label, ": ", count
+        show_counts(y)
 
-    return np.array(x), np.array(y)
+    return x, y
 
 def predict(clf, training, testing):
     """
@@ -151,10 +325,11 @@ def get_auc(clf, x, y, plot=False):
     y   -- labels
     """
     prob = clf.decision_function(x)
-    fpr, tpr, thresh = roc_curve(y, prob)
-    auroc = auc(fpr, tpr)
+    folds = np.zeros(len(y), dtype=int)
+    auroc = metrics.fold_metrics(y, prob, folds)['auroc'][0, 0]
     if plot:
         #plt.figure()
+        fpr, tpr, thresh = roc_curve(y, prob)
         generate_roc_plot(fpr, tpr, 'AUROC=%f'%auroc)
     return auroc
 
@@ -187,12 +362,21 @@ def generate_roc_plot(fpr, tpr, title):
     plt.xlabel('False positive rate')
     plt.ylabel('True positive rate')
 
-def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
-             make_prediction=True, plot_roc=False, plot_val=False):
+def select_task(x, y, pos_class, neg_class, shuffle_rows=True, seed=None):
     """
-    Classify patients based on FDG-PET features
+    Keyword Arguments:
+    x            -- Feature matrix
+    y            -- Numeric LABELS
+    pos_class    -- Name of the positive class ('MCI' for all MCI classes)
+    neg_class    -- Name of the negative class ('MCI' for all MCI classes)
+    shuffle_rows -- Shuffle the patients; keep them in the order of x
+                    otherwise, so that the same task always gives the same
+                    rows (and kernel matrix)
+    seed         -- Seed of the shuffle (default: random)
+
+    Returns the patients of the two classes, with binary labels (1 for
+    the positive class)
     """
-    header = pos_class+" vs "+neg_class+"("+modality+")"
     if pos_class == 'MCI':
         pos_class = ['MCI-C', 'MCI-NC', 'MCI-REV']
     else:
@@ -208,22 +392,120 @@ def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
     print "Positive labels: ", len(pos)
     print "Negative labels: ", len(neg)
     wanted_idx = pos + neg
-    shuffle(wanted_idx)
-    x = x[wanted_idx]
-    y = y[wanted_idx]
+    if shuffle_rows:
+        np.random.RandomState(seed).shuffle(wanted_idx)
+    else:
+        wanted_idx.sort()
+    return x[wanted_idx], np.in1d(y[wanted_idx], pos_label).astype(int)
+
+def kernel_params(kernel):
+    """
+    Keyword Arguments:
+    kernel -- None for the linear SVM on the features, 'linear' or 'rbf'
+              for an SVM on a precomputed kernel matrix
+
+    Returns the SVM parameters shared by all values of C
+    """
+    if kernel is None:
+        # the squared hinge loss of cv.validation_path, so the C picked on
+        # the warm-started path is the C of this model
+        return {'verbose':0, 'tol':1e-5, 'loss':'squared_hinge',
+                'penalty':'l2'}
+    return {'verbose':0, 'tol':1e-5, 'kernel':'precomputed'}
+
+def get_task_data(x, y, pos_class, neg_class, kernel=None, gamma=None,
+                  gram=None, seed=None):
+    """
+    Keyword Arguments:
+    kernel -- None to return the features, 'linear' or 'rbf' to return
+              the kernel matrix of the patients instead
+    gamma  -- Width of the RBF kernel (default: 1/number of features)
+    gram   -- GramCache to take the kernel matrix from (default: a new
+              one held in memory)
+    seed   -- Seed of the order of the patients (default: random)
+
+    Returns the features (or kernel matrix), binary labels and features
+    of a task
+    """
+    if kernel is None:
+        x, y = select_task(x, y, pos_class, neg_class, seed=seed)
+        return x, y, x
+    x, y = select_task(x, y, pos_class, neg_class, shuffle_rows=False)
+    if gram is None:
+        gram = gram_cache.GramCache()
+    return gram.get(x, kernel, gamma, 'standard'), y, x
+
+def search_c(x, y, modality, pos_class='NL', neg_class='AD',
+             param_range=None, n_jobs=None, seed=None, kernel=None,
+             gamma=None, gram=None):
+    """
+    Pick C for a task by successive halving over repeated CV, instead of
+    an exhaustive validation curve
+
+    Keyword Arguments:
+    param_range -- Candidate values of C (default: as in classify)
+    n_jobs      -- Number of processes running the CV (default: one per
+                   core)
+    seed        -- Base seed of the CV folds (default: random)
+    kernel      -- None, 'linear' or 'rbf', see get_task_data
+    gamma       -- Width of the RBF kernel
+    gram        -- GramCache holding the kernel matrices
+
+    Returns the chosen C, and the mean test accuracy of every candidate
+    and repetition run (see cv.successive_halving)
+    """
+    header = pos_class+" vs "+neg_class+"("+modality+")"
+    if seed is None:
+        seed = np.random.randint(2**30)
+    x, y, _ = get_task_data(x, y, pos_class, neg_class, kernel, gamma, gram,
+                            seed)
+    if param_range is None:
+        param_range = np.logspace(-5, 3, 400, base=10)
+    svm_params = kernel_params(kernel)
+    best, scores = cv.successive_halving(x, y, svm_params, param_range,
+                                         max_rep=100, n_folds=5, seed=seed,
+                                         n_jobs=n_jobs, header=header)
+    print header, ": C = ", best
+    return best, scores
+
+def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
+             make_prediction=True, plot_roc=False, plot_val=False,
+             n_jobs=None, seed=None, path=True, kernel=None, gamma=None,
+             gram=None):
+    """
+    Classify patients based on FDG-PET features
+
+    Keyword Arguments:
+    n_jobs -- Number of processes running the CV (default: one per core)
+    seed   -- Base seed of the CV folds (default: random)
+    path   -- Compute the validation curve with the warm-started L2-loss
+              path of cv.validation_path rather than one LinearSVC per C
+    kernel -- None for a LinearSVC on the features, 'linear' or 'rbf' for
+              an SVC on the kernel matrix of the task (see get_task_data)
+    gamma  -- Width of the RBF kernel (default: 1/number of features)
+    gram   -- GramCache holding the kernel matrices
+
+    Returns a dict with the 'train_acc', 'test_acc' and metrics.METRICS
+    of every fold if make_prediction or plot_roc, and the validation
+    curves 'cv_train_acc'/'cv_test_acc' over 'param_range' if plot_val
+    """
+    header = pos_class+" vs "+neg_class+"("+modality+")"
+    if seed is None:
+        seed = np.random.randint(2**30)
+    # the folds permute the rows, so their order must follow the seed too
+    x, y, features = get_task_data(x, y, pos_class, neg_class, kernel, gamma,
+                                   gram, seed)
 
-    svm_params = {}
-    svm_params['verbose'] = 0
+    svm_params = kernel_params(kernel)
     # mri=0.002, pet=0.006
     if C is not None:
         svm_params['C'] = C
     else:
         svm_params['C'] = 0.006
-    svm_params['tol'] = 1e-5
-    #svm_params['kernel'] = 'linear'
-    svm_params['loss'] = 'l1'
-    svm_params['penalty'] = 'l2'
-    clf = svm.LinearSVC(**svm_params)
+    if kernel is None:
+        clf = svm.LinearSVC(**svm_params)
+    else:
+        clf = svm.SVC(**svm_params)
     #clf = svm.SVC(**svm_params)
     #clf = linear_model.SGDClassifier(loss='log', penalty='l2',
                                      #alpha=1,
@@ -236,89 +518,77 @@ def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
     base = 10
     param_range = np.logspace(-5, 3, 400, base=base)
 
-    train_acc = []
-    test_acc = []
-    cv_train_acc = []
-    cv_test_acc = []
-    high_idx = []
+    if make_prediction or plot_roc:
+        result = cv.cross_validate(x, y, svm_params, num_rep, n_folds,
+                                   seed, n_jobs, header)
+        # keep accuracy for each fold so we can see variance
+        train_acc = result['train_acc']
+        test_acc = result['test_acc']
+        coef = result['coef']
+        if kernel == 'linear':
+            # weights of the features, from the dual coefficients
+            coef = np.dot(coef, gram_cache.scale(features))
+        high_idx = np.argsort(coef, axis=2)[:, :, -10:]
+        metrics.report(result, header)
 
     if plot_roc:
         roc_fig, roc_ax = get_roc_ax()
-        rep_auroc = []
         # randomly choose the repititions to draw ROC curves for
         roc_count = 10
-        roc_rep = np.sort(np.random.randint(0, num_rep, roc_count))
-        roc_drawn = 0
-
-    for rep in xrange(num_rep):
-        message = "\rRepitition %d"%(rep+1)+": "+header
-        sys.stdout.write(message)
-        sys.stdout.flush()
-        kfold = cross_validation.KFold(len(x), n_folds=n_folds, shuffle=True)
-        fold_train_acc = []
-        fold_test_acc = []
-        fold_cv_train_acc = []
-        fold_cv_test_acc = []
-        idx = 0
-        for train_idx, test_idx in kfold:
-            idx += 1
-            sys.stdout.write(message+": Fold %d..."%idx)
-            sys.stdout.flush()
+        roc_rep = np.unique(np.random.randint(0, num_rep, roc_count))
+        for rep in roc_rep:
+            for fold in xrange(n_folds):
+                test_idx = result['folds'][rep] == fold
+                fpr, tpr, _ = roc_curve(y[test_idx],
+                                        result['scores'][rep, test_idx])
+                roc_ax.plot(fpr, tpr)
+        auroc = metrics.summarize(result['auroc'])
 
-            # pre-process and clean data
-            scaler = StandardScaler(with_mean=True,
-                                    with_std=True).fit(x[train_idx])
-            binarizer = LabelBinarizer().fit(y[train_idx])
-            x = scaler.transform(x)
-            y = binarizer.transform(y).ravel()
-
-            x_train, x_test = x[train_idx], x[test_idx]
-            y_train, y_test = y[train_idx], y[test_idx]
-
-            if make_prediction:
-                clf = svm.LinearSVC(**svm_params)
-                clf.fit(x_train, y_train)
-                high_idx.append(np.argsort(clf.coef_[0])[-10:])
-                accuracy = predict(clf, (x_train, y_train), (x_test, y_test))
-                fold_train_acc.append(accuracy[0])
-                fold_test_acc.append(accuracy[1])
-            if plot_roc:
-                fpr, tpr, _ = roc_curve(y_test, clf.decision_function(x_test))
-                rep_auroc.append(auc(fpr, tpr))
-                if roc_rep[roc_drawn] == rep:
-                    roc_ax.plot(fpr, tpr)
-                    rep += 1
-            if plot_val:
-                train_scores, test_scores = validation_curve(clf,
-                                                             x_train, y_train,
-                                                             param_name="C",
-                                                             param_range=\
-                                                             param_range,
-                                                             cv=n_folds,
-                                                             #scoring="roc_auc")
-                                                             scoring="accuracy")
+    cv_train_acc = []
+    cv_test_acc = []
+    if plot_val:
+        for rep in xrange(num_rep):
+            message = "\rRepitition %d"%(rep+1)+": "+header
+            sys.stdout.write(message)
+            sys.stdout.flush()
+            folds = cv.get_folds(len(x), n_folds, seed, rep)
+            fold_cv_train_acc = []
+            fold_cv_test_acc = []
+            for fold in xrange(n_folds):
+                sys.stdout.write(message+": Fold %d..."%(fold+1))
+                sys.stdout.flush()
+                train_idx = folds != fold
+                if kernel is not None:
+                    x_train = x[np.ix_(train_idx, train_idx)]
+                else:
+                    x_train = StandardScaler(with_mean=True, with_std=True)\
+                        .fit_transform(x[train_idx])
+                if path and kernel is None:
+                    train_scores, test_scores = cv.validation_path(
+                        x_train, y[train_idx], param_range, n_folds,
+                        seed, rep*n_folds + fold)
+                else:
+                    train_scores, test_scores = validation_curve(
+                        clf, x_train, y[train_idx], param_name="C",
+                        param_range=param_range, cv=n_folds,
+                        #scoring="roc_auc")
+                        scoring="accuracy")
                 # take average accross inner folds
                 fold_cv_train_acc.append(np.mean(train_scores, axis=1))
                 fold_cv_test_acc.append(np.mean(test_scores, axis=1))
 
-        if plot_val:
             # now take average accross outer folds
             cv_train_acc.append(np.array(fold_cv_train_acc).mean(axis=0))
             cv_test_acc.append(np.array(fold_cv_test_acc).mean(axis=0))
-        # keep accuracy for each fold so we can see variance
-        train_acc.append(np.array(fold_train_acc))
-        test_acc.append(np.array(fold_test_acc))
 
-    train_acc = np.array(train_acc)
-    test_acc = np.array(test_acc)
     cv_train_acc = np.array(cv_train_acc)
     cv_test_acc = np.array(cv_test_acc)
 
-
     if plot_roc:
-        roc_ax.set_title(header+': AUROC=%f'%np.mean(rep_auroc))
+        roc_ax.set_title(header+': AUROC=%.3f (95%% CI: %.3f-%.3f)'
+                         %(auroc[0], auroc[2], auroc[3]))
         roc_fig.savefig(header+'(ROC)')
-    if make_prediction:
+    if make_prediction and kernel != 'rbf':
         plt.figure()
         high_idx = np.ravel(high_idx)
         plt.hist(np.ravel(high_idx), bins=np.arange(max(high_idx)))
@@ -326,6 +596,7 @@ def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
         plt.ylabel('Count')
         plt.title(header+": High wt. features")
         plt.savefig(header+'(wt)')
+    if make_prediction:
         plt.figure()
         plt.title(header+": Classification accuracy of SVM")
         plt.xlabel("Repitition number")
@@ -368,41 +639,105 @@ def classify(x, y, modality, pos_class='NL', neg_class='AD', C=None,
                          alpha=0.2, color="g")
         plt.legend(loc="best")
 
-def run_all(job='results'):
+    output = {}
+    if make_prediction or plot_roc:
+        for name in ['train_acc', 'test_acc'] + metrics.METRICS:
+            output[name] = result[name]
+    if plot_val:
+        output['param_range'] = param_range
+        output['cv_train_acc'] = cv_train_acc
+        output['cv_test_acc'] = cv_test_acc
+    return output
+
+def run_all(job='results', kernel=None, gamma=None, gram_dir=None,
+            results_dir=scheduler.RESULTS_DIR, shard=0, num_shards=1,
+            seed=0):
     """
     Do hyper-parameter search for all
+
+    Every (task, modality) cell is run through a scheduler.Scheduler: its
+    result is saved in results_dir as soon as it is done, and cells with a
+    saved result are skipped, so an interrupted run picks up where it
+    stopped. To split the grid over machines, run every shard with the
+    same settings and num_shards, then scheduler.merge the directories.
+
+    Keyword Arguments:
+    job         -- 'results' for the accuracy/ROC plots, 'hyper-search'
+                   for the validation curves, 'halving' to pick C by
+                   successive halving. 'halving' returns the chosen C in
+                   the layout of C below (NaN for cells not run yet).
+    kernel      -- None, 'linear' or 'rbf', see classify. The kernel
+                   matrix of every task is computed once and reused for
+                   all C.
+    gamma       -- Width of the RBF kernel
+    gram_dir    -- Directory to memory-map the kernel matrices from
+                   (default: held in memory)
+    results_dir -- Where the results of the cells are saved
+    shard       -- The shard of the cells run here (0 to num_shards-1)
+    num_shards  -- Number of shards the cells are split in
+    seed        -- Base seed of the order of the patients and of the CV
+                   folds; part of the settings of a cell, so rerunning
+                   with the same seed reuses results
     """
     PET_X, PET_Y, _ = generate_features_fdg_bl()
-    MRI_X, MRI_Y, _ = generate_features_fdg_bl()
+    MRI_X, MRI_Y, _ = generate_features_mri_bl()
     CAT_X, CAT_Y = generate_features_concat()
 
     tasks = [['NL', 'MCI'], ['MCI-C', 'MCI-NC'], ['MCI', 'AD'], ['NL', 'AD']]
     modalities = {'PET':[PET_X, PET_Y], 'MRI':[MRI_X, MRI_Y],
                   'CAT':[CAT_X, CAT_Y]}
+    # the columns of C
+    names = ['PET', 'MRI', 'CAT']
     C = np.array([[0.8, 0.9, 0.011],
                   [0.003, 0.0025, 0.001],
                   [0.02, 0.02, 0.015],
                   [0.01, 0.008, 0.008]])
-    task_num = 0
-    modal_num = 0
-    for task in tasks:
-        print "\nSolving task: ", task
-        modal_num = 0
-        for name, data in modalities.items():
-            print "Solving modality: ", name
-            if job == 'hyper-search':
-                classify(data[0], data[1], name, task[0], task[1],
-                         C[task_num, modal_num],
-                         False, False, True)
-            elif job == 'results':
-                classify(data[0], data[1], name, task[0], task[1],
-                         C[task_num, modal_num],
-                         True, True, False)
-            message = name+": "+task[0]+" vs "+task[1]
-            plt.savefig(message + "(acc)")
-            modal_num += 1
-            #plt.show(block=False)
-        task_num += 1
+
+    sched = scheduler.Scheduler(results_dir, shard, num_shards)
+    for name in names:
+        digest = scheduler.data_digest(*modalities[name])
+        for task_num, task in enumerate(tasks):
+            config = {'job':job, 'pos_class':task[0], 'neg_class':task[1],
+                      'modality':name, 'kernel':kernel, 'gamma':gamma,
+                      'seed':seed}
+            if job != 'halving':
+                config['C'] = float(C[task_num, names.index(name)])
+            sched.add(config, digest)
+    sched.write_manifest()
+
+    gram = gram_cache.GramCache(gram_dir)
+    def run_cell(config):
+        """
+        Run one (task, modality) cell and return its result
+        """
+        name, task = config['modality'], [config['pos_class'],
+                                          config['neg_class']]
+        data = modalities[name]
+        if job == 'halving':
+            best, scores = search_c(data[0], data[1], name, task[0],
+                                    task[1], seed=seed, kernel=kernel,
+                                    gamma=gamma, gram=gram)
+            return {'C':best, 'scores':scores}
+        result = classify(data[0], data[1], name, task[0], task[1],
+                          config['C'], job == 'results', job == 'results',
+                          job == 'hyper-search', seed=seed, kernel=kernel,
+                          gamma=gamma, gram=gram)
+        message = name+": "+task[0]+" vs "+task[1]
+        plt.savefig(message + "(acc)")
+        #plt.show(block=False)
+        return result
+    sched.run(run_cell)
+
+    if job == 'halving':
+        best_C = np.empty(C.shape)
+        best_C.fill(np.nan)
+        for config, result in sched.results():
+            task = [config['pos_class'], config['neg_class']]
+            best_C[tasks.index(task), names.index(config['modality'])] = \
+                result['C']
+        print "\nChosen C (tasks x modalities", names, "):"
+        print best_C
+        return best_C
 
 def main():
     """
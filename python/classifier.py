@@ -1,14 +1,115 @@
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from sklearn import linear_model
 
-data = pd.read_csv('../viterbi_prob_train.csv')
-x = data[data.columns[:-3]]
-y = data['DX']
+# written by hmm.write_viterbi_prob: RID, the state probabilities, then
+# DX, MMSE and CDR
+TRAIN_FILE = '../viterbi_prob_train.csv'
 
-logreg = linear_model.LogisticRegression(penalty='l2',
-                                         fit_intercept=True,
-                                         C=1e-3)
+def split(data):
+    """
+    Returns the features (the state probabilities) and labels of a table
+    of HMM features
+    """
+    features = [col for col in data.columns[:-3] if col != 'RID']
+    return data[features].values, data['DX'].values
 
+def with_bias(x):
+    """
+    Returns x with a column of ones appended, whose weight is an intercept
+    penalised like the other weights, as liblinear does
+    """
+    return np.hstack([x, np.ones((len(x), 1))])
 
+def holdout_mask(data, holdout=0.2):
+    """
+    Keyword Arguments:
+    data    -- Rows of the features file
+    holdout -- Fraction of the patients to hold out
+
+    Returns whether each row is held out. The choice depends on a hash of
+    the RID only, so all the rows of a patient (one per fold they are
+    trained in) are on the same side, in every chunk, pass and run.
+    """
+    hashed = pd.util.hash_pandas_object(data['RID'], index=False).values
+    return (hashed % 1000) < holdout*1000
+
+def batch_fit(file_name=TRAIN_FILE, holdout=0.2, C=1e-3):
+    """
+    Fit the logistic regression on all the training rows at once
+
+    Keyword Arguments:
+    file_name -- The features file
+    holdout   -- Fraction of the patients held out (see holdout_mask)
+    C         -- Inverse of the regularisation strength
+
+    Returns the model and its accuracy on the held out rows
+    """
+    data = pd.read_csv(file_name)
+    test = holdout_mask(data, holdout)
+    x, y = split(data)
+    logreg = linear_model.LogisticRegression(penalty='l2',
+                                             fit_intercept=True,
+                                             C=C)
+    logreg.fit(x[~test], y[~test])
+    return logreg, logreg.score(x[test], y[test])
+
+def stream_fit(file_name=TRAIN_FILE, chunksize=100000, n_passes=5,
+               holdout=0.2, C=1e-3, seed=0):
+    """
+    Fit the logistic regression by SGD, reading the features file in
+    chunks so that memory is bounded by chunksize rows
+
+    Keyword Arguments:
+    file_name -- The features file
+    chunksize -- Number of rows read at a time
+    n_passes  -- Number of passes over the file
+    holdout   -- Fraction of the patients held out (see holdout_mask)
+    C         -- Inverse of the regularisation strength, as in batch_fit
+    seed      -- Seed of the SGD and of the order of the rows of a chunk
+
+    Returns the model and its accuracy on the held out rows
+    """
+    # every DX code of the file, which a chunk may not all contain
+    num_train, classes = 0, np.array([], dtype=int)
+    for chunk in pd.read_csv(file_name, chunksize=chunksize,
+                             usecols=['RID', 'DX']):
+        num_train += (~holdout_mask(chunk, holdout)).sum()
+        classes = np.union1d(classes, chunk['DX'].unique())
+    # SGD minimises the mean loss plus alpha/2 |w|^2, LogisticRegression
+    # the summed loss times C plus 1/2 |w|^2, where w includes the
+    # intercept, so it is fitted as the weight of a column of ones
+    alpha = 1.0/(C*max(num_train, 1))
+
+    rng = np.random.RandomState(seed)
+    logreg = linear_model.SGDClassifier(loss='log', penalty='l2',
+                                        alpha=alpha, fit_intercept=False,
+                                        random_state=seed)
+    for _ in xrange(n_passes):
+        for chunk in pd.read_csv(file_name, chunksize=chunksize):
+            train = ~holdout_mask(chunk, holdout)
+            x, y = split(chunk[train])
+            order = rng.permutation(len(y))
+            if len(y):
+                logreg.partial_fit(with_bias(x[order]), y[order],
+                                   classes=classes)
+    # back to the weights of the features and an intercept, as in batch_fit
+    logreg.intercept_ = logreg.coef_[:, -1].copy()
+    logreg.coef_ = logreg.coef_[:, :-1].copy()
+
+    correct, total = 0, 0
+    for chunk in pd.read_csv(file_name, chunksize=chunksize):
+        x, y = split(chunk[holdout_mask(chunk, holdout)])
+        if len(y):
+            correct += (logreg.predict(x) == y).sum()
+            total += len(y)
+    return logreg, correct/float(max(total, 1))
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['stream']:
+        logreg, accuracy = stream_fit()
+    else:
+        logreg, accuracy = batch_fit()
+    print "Held out accuracy: %.3f"%accuracy
@@ -0,0 +1,346 @@
+"""
+Repeated k-fold cross validation of a linear SVM, or of an SVM on a
+precomputed kernel matrix, with the (repetition, fold) units spread over
+a pool of worker processes.
+
+Every unit draws its folds and solver seed from the repetition number
+and a base seed only, so the results do not depend on how many workers
+are used or in which order they finish.
+
+"""
+
+import sys
+import multiprocessing as mp
+import numpy as np
+from scipy.optimize import fmin_l_bfgs_b
+
+from sklearn import svm
+from sklearn.preprocessing import StandardScaler
+
+import metrics
+
+# the data and settings of the current run, as seen by a worker
+SHARED = {}
+
+def get_folds(num_samples, n_folds, seed, rep):
+    """
+    Keyword Arguments:
+    num_samples -- Number of samples to split
+    n_folds     -- Number of folds
+    seed        -- Base seed of the run
+    rep         -- Repetition number
+
+    Returns the fold number of every sample in repetition rep
+    """
+    perm = np.random.RandomState(seed + rep).permutation(num_samples)
+    folds = np.empty(num_samples, dtype=int)
+    for fold, idx in enumerate(np.array_split(perm, n_folds)):
+        folds[idx] = fold
+    return folds
+
+def share_array(array):
+    """
+    Keyword Arguments:
+    array -- The numpy array to share
+
+    Returns a copy of array in shared memory, with its dtype and shape
+    """
+    array = np.ascontiguousarray(array)
+    buf = mp.RawArray('b', max(array.nbytes, 1))
+    np.frombuffer(buf, dtype=array.dtype, count=array.size)[:] = \
+        array.ravel()
+    return buf, array.dtype.str, array.shape
+
+def attach_array(buf, dtype, shape):
+    """
+    Keyword Arguments:
+    buf   -- Shared buffer made by share_array
+    dtype -- dtype of the array
+    shape -- shape of the array
+
+    Returns a numpy view of the shared array
+    """
+    size = int(np.prod(shape))
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+def init_worker(x, y, params, n_folds, seed):
+    """
+    Attach a worker to the data of the run
+
+    Keyword Arguments:
+    x       -- Shared feature matrix (as made by share_array)
+    y       -- Shared binary labels (as made by share_array)
+    params  -- Parameters for svm.LinearSVC, or for svm.SVC if
+               params['kernel'] is 'precomputed'
+    n_folds -- Number of folds
+    seed    -- Base seed of the run
+    """
+    SHARED['x'] = attach_array(*x)
+    SHARED['y'] = attach_array(*y)
+    SHARED['params'] = params
+    SHARED['n_folds'] = n_folds
+    SHARED['seed'] = seed
+
+def fit_unit(unit):
+    """
+    Fit and score the classifier on one fold of one repetition
+
+    Keyword Arguments:
+    unit -- (rep, fold) to run, or (rep, fold, C) to override C
+    """
+    rep, fold = unit[:2]
+    x, y = SHARED['x'], SHARED['y']
+    n_folds, seed = SHARED['n_folds'], SHARED['seed']
+
+    folds = get_folds(len(y), n_folds, seed, rep)
+    train_idx = np.flatnonzero(folds != fold)
+    test_idx = np.flatnonzero(folds == fold)
+
+    y_train, y_test = y[train_idx], y[test_idx]
+
+    params = dict(SHARED['params'])
+    if len(unit) > 2:
+        params['C'] = unit[2]
+    params['random_state'] = (seed + rep*n_folds + fold) % (2**31 - 1)
+    if params.get('kernel') == 'precomputed':
+        # x is the kernel matrix of all samples; slice it instead of
+        # scaling features
+        x_train = x[np.ix_(train_idx, train_idx)]
+        x_test = x[np.ix_(test_idx, train_idx)]
+        clf = svm.SVC(**params).fit(x_train, y_train)
+        coef = np.zeros(len(y))
+        coef[train_idx[clf.support_]] = clf.dual_coef_[0]
+    else:
+        scaler = StandardScaler(with_mean=True, with_std=True)
+        x_train = scaler.fit_transform(x[train_idx].astype(np.float64))
+        x_test = scaler.transform(x[test_idx].astype(np.float64))
+        clf = svm.LinearSVC(**params).fit(x_train, y_train)
+        coef = clf.coef_[0]
+
+    decision = clf.decision_function(x_test)
+    train_acc = np.mean(clf.predict(x_train) == y_train)
+    test_acc = np.mean(clf.predict(x_test) == y_test)
+
+    return unit, train_acc, test_acc, coef, decision
+
+def run_units(units, x, y, params, n_folds, seed, n_jobs):
+    """
+    Keyword Arguments:
+    units   -- The (rep, fold[, C]) units to run
+    x       -- Feature matrix
+    y       -- Binary labels
+    params  -- Parameters for svm.LinearSVC
+    n_folds -- Number of folds
+    seed    -- Base seed of the run
+    n_jobs  -- Number of worker processes (default: one per core)
+
+    Yields the output of fit_unit for every unit, in no particular order
+    """
+    if n_jobs is None:
+        n_jobs = mp.cpu_count()
+    initargs = (share_array(x), share_array(y), params, n_folds, seed)
+    if n_jobs == 1:
+        init_worker(*initargs)
+        for unit in units:
+            yield fit_unit(unit)
+        return
+
+    pool = mp.Pool(n_jobs, init_worker, initargs)
+    try:
+        for fitted in pool.imap_unordered(fit_unit, units,
+                                          max(1, len(units)//(4*n_jobs))):
+            yield fitted
+    finally:
+        pool.close()
+        pool.join()
+
+def cross_validate(x, y, params, num_rep=100, n_folds=5, seed=None,
+                   n_jobs=None, header=''):
+    """
+    Keyword Arguments:
+    x       -- Feature matrix (unscaled, one row per patient), or the
+               kernel matrix of the patients if params['kernel'] is
+               'precomputed' (see gram_cache)
+    y       -- Binary labels (1 for the positive class)
+    params  -- Parameters for svm.LinearSVC, or for svm.SVC with a
+               precomputed kernel
+    num_rep -- Number of repetitions of k-fold CV
+    n_folds -- Number of folds
+    seed    -- Base seed (default: drawn from np.random)
+    n_jobs  -- Number of worker processes (default: one per core)
+    header  -- Message shown with the progress
+
+    Returns a dict with arrays 'train_acc', 'test_acc' and the
+    metrics.METRICS ('auroc', ...) of every fold (num_rep x n_folds),
+    'coef' (num_rep x n_folds x features; the dual coefficient of every
+    sample for a precomputed kernel), and 'scores'/'folds' (num_rep x
+    samples) holding the out-of-fold decision value and fold number of
+    every sample.
+    """
+    if seed is None:
+        seed = np.random.randint(2**30)
+    y = np.asarray(y)
+
+    result = {}
+    for name in ['train_acc', 'test_acc']:
+        result[name] = np.empty((num_rep, n_folds))
+    result['coef'] = np.empty((num_rep, n_folds, x.shape[1]))
+    result['scores'] = np.empty((num_rep, len(y)))
+    result['folds'] = np.empty((num_rep, len(y)), dtype=int)
+    for rep in xrange(num_rep):
+        result['folds'][rep] = get_folds(len(y), n_folds, seed, rep)
+
+    units = [(rep, fold) for rep in xrange(num_rep)
+             for fold in xrange(n_folds)]
+    fitted = run_units(units, x, y, params, n_folds, seed, n_jobs)
+    for done, unit in enumerate(fitted):
+        (rep, fold), train_acc, test_acc, coef, decision = unit
+        result['train_acc'][rep, fold] = train_acc
+        result['test_acc'][rep, fold] = test_acc
+        result['coef'][rep, fold] = coef
+        result['scores'][rep, result['folds'][rep] == fold] = decision
+        sys.stdout.write("\r%s: %d/%d folds done"%(header, done+1,
+                                                    len(units)))
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+    result.update(metrics.fold_metrics(y, result['scores'], result['folds']))
+
+    return result
+
+def squared_hinge(w, x, y, C):
+    """
+    Keyword Arguments:
+    w -- Weights, with the intercept last
+    x -- Feature matrix, with a trailing column of ones
+    y -- Labels in {-1, 1}
+    C -- Penalty on the loss
+
+    Returns the objective 0.5*|w|^2 + C*sum(max(0, 1 - y*x.w)^2) of an
+    L2-loss linear SVM (as in liblinear), and its gradient
+    """
+    margin = 1 - y*x.dot(w)
+    active = margin > 0
+    slack = margin[active]
+    loss = 0.5*w.dot(w) + C*slack.dot(slack)
+    grad = w - 2*C*(y[active]*slack).dot(x[active])
+    return loss, grad
+
+def fit_path(x, y, param_range, tol=1e-5, max_iter=1000):
+    """
+    Fit an L2-loss linear SVM for every C in param_range, in increasing
+    order of C, starting each fit from the solution for the previous C.
+    This is the warm-started search liblinear itself uses to pick C.
+
+    Keyword Arguments:
+    x           -- Feature matrix (already scaled)
+    y           -- Binary labels (1 for the positive class)
+    param_range -- The values of C
+    tol         -- Tolerance on the projected gradient
+    max_iter    -- Maximum number of L-BFGS iterations per C
+
+    Returns a (len(param_range) x features+1) matrix of weights, with the
+    intercept in the last column
+    """
+    x = np.c_[x, np.ones(len(x))]
+    y = np.where(y == 1, 1., -1.)
+    coef = np.empty((len(param_range), x.shape[1]))
+    w = np.zeros(x.shape[1])
+    for i in np.argsort(param_range):
+        w = fmin_l_bfgs_b(squared_hinge, w, args=(x, y, param_range[i]),
+                          pgtol=tol, factr=10, maxiter=max_iter)[0]
+        coef[i] = w
+    return coef
+
+def path_accuracy(coef, x, y):
+    """
+    Keyword Arguments:
+    coef -- Weights from fit_path
+    x    -- Feature matrix
+    y    -- Binary labels (1 for the positive class)
+
+    Returns the accuracy of every set of weights on (x, y)
+    """
+    predicted = (x.dot(coef[:, :-1].T) + coef[:, -1]) > 0
+    return (predicted == (y == 1)[:, np.newaxis]).mean(axis=0)
+
+def validation_path(x, y, param_range, n_folds=5, seed=0, rep=0):
+    """
+    Keyword Arguments:
+    x           -- Feature matrix (already scaled)
+    y           -- Binary labels (1 for the positive class)
+    param_range -- The values of C
+    n_folds     -- Number of CV folds
+    seed        -- Base seed of the folds
+    rep         -- Repetition number of the folds
+
+    Returns the training and testing accuracy (len(param_range) x n_folds)
+    for every C, like sklearn's validation_curve with scoring="accuracy"
+    """
+    folds = get_folds(len(y), n_folds, seed, rep)
+    train_scores = np.empty((len(param_range), n_folds))
+    test_scores = np.empty((len(param_range), n_folds))
+    for fold in xrange(n_folds):
+        train, test = folds != fold, folds == fold
+        coef = fit_path(x[train], y[train], param_range)
+        train_scores[:, fold] = path_accuracy(coef, x[train], y[train])
+        test_scores[:, fold] = path_accuracy(coef, x[test], y[test])
+    return train_scores, test_scores
+
+def successive_halving(x, y, params, param_range, min_rep=1, max_rep=100,
+                       eta=3, n_folds=5, seed=None, n_jobs=None, header=''):
+    """
+    Search for the C with the best CV test accuracy by successive halving:
+    every candidate is scored on min_rep repetitions of k-fold CV, the
+    best 1/eta of them are kept, and the survivors are scored on eta
+    times as many repetitions, until one is left or max_rep is reached.
+    Repetitions already run for a survivor are reused.
+
+    Keyword Arguments:
+    x           -- Feature matrix (unscaled, one row per patient), or
+                   the kernel matrix of the patients
+    y           -- Binary labels (1 for the positive class)
+    params      -- Parameters for svm.LinearSVC or svm.SVC, as for
+                   cross_validate (C is overridden)
+    param_range -- The candidate values of C
+    min_rep     -- Repetitions given to every candidate
+    max_rep     -- Repetitions given to the last survivors
+    eta         -- Fraction of candidates dropped at every round
+    n_folds     -- Number of folds
+    seed        -- Base seed (default: drawn from np.random)
+    n_jobs      -- Number of worker processes (default: one per core)
+    header      -- Message shown with the progress
+
+    Returns the best C, and a (len(param_range) x max_rep) array of the
+    mean test accuracy of every repetition run (NaN where skipped)
+    """
+    if seed is None:
+        seed = np.random.randint(2**30)
+    param_range = np.asarray(param_range)
+    scores = np.empty((len(param_range), max_rep, n_folds))
+    scores.fill(np.nan)
+
+    index = dict((C, i) for i, C in enumerate(param_range))
+    alive = np.arange(len(param_range))
+    done, reps = 0, min(min_rep, max_rep)
+    while True:
+        units = [(rep, fold, param_range[i]) for i in alive
+                 for rep in xrange(done, reps) for fold in xrange(n_folds)]
+        for fitted in run_units(units, x, y, params, n_folds, seed, n_jobs):
+            rep, fold, C = fitted[0]
+            scores[index[C], rep, fold] = fitted[2]
+        sys.stdout.write("\r%s: %d candidates, %d repetitions"
+                         %(header, len(alive), reps))
+        sys.stdout.flush()
+
+        mean = scores[alive, :reps].reshape(len(alive), -1).mean(axis=1)
+        # stable sort, so ties go to the smaller index
+        alive = alive[np.argsort(-mean, kind='mergesort')]
+        if reps == max_rep:
+            break
+        alive = alive[:int(np.ceil(len(alive)/float(eta)))]
+        if len(alive) == 1:
+            break
+        done, reps = reps, min(reps*eta, max_rep)
+    sys.stdout.write("\n")
+
+    return param_range[alive[0]], scores.mean(axis=2)
@@ -0,0 +1,123 @@
+"""
+Gram matrices of the baseline cohorts, for SVMs with a precomputed kernel
+
+A cohort holds a few hundred patients, so the full kernel matrix is small
+and can be computed once and sliced for every fold, repetition and value
+of C instead of refitting from the raw features.
+
+"""
+
+import os
+import hashlib
+import numpy as np
+
+from read import atomic_path
+
+KERNELS = ['linear', 'rbf']
+SCALINGS = [None, 'standard']
+
+def scale(x, scaling='standard'):
+    """
+    Keyword Arguments:
+    x       -- Feature matrix
+    scaling -- 'standard' to centre every feature and divide it by its
+               standard deviation, None to keep x as is
+
+    Returns the scaled features as float64
+    """
+    assert scaling in SCALINGS, "Unknown scaling: %s"%scaling
+    x = np.asarray(x, dtype=np.float64)
+    if scaling is None:
+        return x
+    std = x.std(axis=0)
+    std[std == 0] = 1.0
+    return (x - x.mean(axis=0))/std
+
+def gram_matrix(x, kernel='linear', gamma=None):
+    """
+    Keyword Arguments:
+    x      -- (scaled) feature matrix
+    kernel -- 'linear' or 'rbf'
+    gamma  -- Width of the RBF kernel (default: 1/number of features)
+
+    Returns the (samples x samples) kernel matrix of x
+    """
+    assert kernel in KERNELS, "Unknown kernel: %s"%kernel
+    gram = np.dot(x, x.T)
+    if kernel == 'linear':
+        return gram
+    if gamma is None:
+        gamma = 1.0/x.shape[1]
+    norms = np.diag(gram).copy()
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, reusing the dot products
+    gram *= -2
+    gram += norms[:, np.newaxis]
+    gram += norms[np.newaxis, :]
+    np.maximum(gram, 0, out=gram)
+    gram *= -gamma
+    return np.exp(gram, out=gram)
+
+class GramCache(object):
+    """
+    Kernel matrices keyed on the contents of the feature matrix and the
+    kernel settings, so the same cohort (modality, task and row order) is
+    only ever computed once. Matrices are held in memory, or stored as
+    .npy files in a directory and memory-mapped back.
+    """
+    def __init__(self, directory=None):
+        """
+        Keyword Arguments:
+        directory -- Where to store the matrices (default: memory only)
+        """
+        self.directory = directory
+        self.matrices = {}
+
+    def key(self, x, kernel, gamma, scaling):
+        """
+        Returns the digest naming the kernel matrix of x
+        """
+        x = np.ascontiguousarray(x)
+        digest = hashlib.md5(x.view(np.uint8))
+        digest.update('%s:%s:%r:%r:%s'%(x.dtype.str, x.shape, kernel,
+                                          gamma, scaling))
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        Returns the file holding the kernel matrix named key
+        """
+        return os.path.join(self.directory, 'gram-%s.npy'%key)
+
+    def get(self, x, kernel='linear', gamma=None, scaling='standard'):
+        """
+        Keyword Arguments:
+        x       -- Feature matrix (unscaled, one row per patient)
+        kernel  -- 'linear' or 'rbf'
+        gamma   -- Width of the RBF kernel (default: 1/number of features)
+        scaling -- Scaling of the features, see scale
+
+        Returns the kernel matrix of the rows of x
+        """
+        key = self.key(x, kernel, gamma, scaling)
+        if key in self.matrices:
+            return self.matrices[key]
+
+        if self.directory is not None and os.path.exists(self.path(key)):
+            gram = np.load(self.path(key), mmap_mode='r')
+        else:
+            gram = gram_matrix(scale(x, scaling), kernel, gamma)
+            if self.directory is not None:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                with atomic_path(self.path(key)) as tmp, \
+                     open(tmp, 'wb') as handle:
+                    np.save(handle, gram)
+                gram = np.load(self.path(key), mmap_mode='r')
+        self.matrices[key] = gram
+        return gram
+
+    def clear(self):
+        """
+        Forget the matrices held in memory (files are kept)
+        """
+        self.matrices.clear()
@@ -0,0 +1,823 @@
+"""
+Gaussian hidden Markov models of the FDG-PET visits of every patient
+
+Python counterpart of matlab/getPetData.m and matlab/hmm.m (pmtk3
+hmmFit). The visit sequences of all patients are padded to the longest
+one and handled as one (patients x visits x features) batch with a mask,
+and Baum-Welch runs in log space over the whole batch at once.
+
+"""
+
+import os
+import sys
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from scipy.linalg import cholesky, solve_triangular
+
+from read import CACHE_DIR, atomic_path
+import read_pet as pet
+import scheduler
+import cross_val as cv
+
+# clinical labels of the visits, coded 1, 2, ... in this order
+LABEL_NAMES = ['NL', 'MCI', 'AD']
+
+def logsumexp(a, axis):
+    """
+    Keyword Arguments:
+    a    -- Array of log values
+    axis -- Axis to sum over
+
+    Returns log(sum(exp(a))) along axis, without overflow
+    """
+    top = np.max(a, axis=axis, keepdims=True)
+    top[~np.isfinite(top)] = 0
+    with np.errstate(divide='ignore'):
+        return np.log(np.sum(np.exp(a - top), axis=axis)) + \
+            np.squeeze(top, axis=axis)
+
+def get_label_codes(dx, label_names=LABEL_NAMES):
+    """
+    Keyword Arguments:
+    dx          -- The diagnosis of every visit ('NL', 'MCI-C', ...)
+    label_names -- LABEL_NAMES, or ['NL', 'MCI-NC', 'MCI-C', 'AD'] to keep
+                   the MCI converters apart
+
+    Returns the code of every label (0 if unknown), as getLabels.m
+    """
+    if list(label_names) == ['NL', 'MCI-NC', 'MCI-C', 'AD']:
+        names = {'NL':1, 'MCI-NC':2, 'MCI-C':3, 'AD':4}
+    else:
+        names = {'NL':1, 'MCI':2, 'MCI-NC':2, 'MCI-C':2, 'AD':3}
+    return np.array([names.get(label, 0) for label in dx], dtype=int)
+
+def pad(values, lengths):
+    """
+    Keyword Arguments:
+    values  -- The visits of all patients, one after another
+    lengths -- Number of visits of every patient
+
+    Returns values as a (patients x max(lengths) x ...) array, padded with
+    zeros, and the (patients x max(lengths)) mask of the real visits
+    """
+    values = np.asarray(values)
+    mask = np.arange(max(lengths))[np.newaxis, :] < \
+        np.asarray(lengths)[:, np.newaxis]
+    padded = np.zeros(mask.shape + values.shape[1:], dtype=values.dtype)
+    padded[mask] = values
+    return padded, mask
+
+def has_bad_transition(labels, mask):
+    """
+    Keyword Arguments:
+    labels -- (patients x visits) label codes, with LABEL_NAMES
+    mask   -- (patients x visits) mask of the real visits
+
+    Returns whether each patient goes from AD to MCI or NL, or from NL to
+    AD, between two visits (removeNoise.m)
+    """
+    nl, mci, ad = 1, 2, 3
+    before, after = labels[:, :-1], labels[:, 1:]
+    bad = (((before == ad) & ((after == mci) | (after == nl))) |
+           ((before == nl) & (after == ad)))
+    return (bad & mask[:, 1:]).any(axis=1)
+
+def get_sequences(data=None, label_names=LABEL_NAMES, min_visits=1):
+    """
+    Keyword Arguments:
+    data        -- Flattened PET visits (default: read_pet.flatten_pet())
+    label_names -- See get_label_codes
+    min_visits  -- Keep only patients with at least this many visits
+
+    Returns a dict with the padded batch of visit sequences of the
+    patients, in order of RID: 'x' (patients x visits x features, the
+    mean uptake of every region), 'mask', 'labels', 'convtime', 'mmse',
+    'cdr' (patients x visits), 'rid', 'lengths' and 'label_names'.
+    Visits without MMSE or CDR, and patients with an unlikely change of
+    diagnosis, are left out as in getPetData.m.
+    """
+    if data is None:
+        data = pet.flatten_pet()
+
+    mmse = data['MMSCORE'].values.astype(float)
+    cdr = data['CDGLOBAL'].values.astype(float)
+    keep = (mmse != -1) & ~np.isnan(mmse) & (cdr != -1) & ~np.isnan(cdr)
+    data = data[keep]
+    # visits keep their order within a patient
+    data = data.iloc[np.argsort(data['RID'].values, kind='mergesort')]
+
+    features = [col for col in data.columns if col.endswith('_MEAN')]
+    rid, lengths = np.unique(data['RID'].values, return_counts=True)
+    seqs = {}
+    seqs['x'], mask = pad(data[features].values.astype(float), lengths)
+    seqs['labels'], _ = pad(get_label_codes(data['DX'].values, label_names),
+                            lengths)
+    for name, column in [('convtime', 'CONVTIME'), ('mmse', 'MMSCORE'),
+                         ('cdr', 'CDGLOBAL')]:
+        seqs[name], _ = pad(data[column].values.astype(float), lengths)
+
+    good = (lengths >= min_visits)
+    if list(label_names) == LABEL_NAMES:
+        good &= ~has_bad_transition(seqs['labels'], mask)
+    for name in seqs:
+        seqs[name] = seqs[name][good]
+    seqs['mask'] = mask[good]
+    seqs['rid'] = rid[good]
+    seqs['lengths'] = lengths[good]
+    seqs['label_names'] = list(label_names)
+    return seqs
+
+def data_stats(x, mask):
+    """
+    Keyword Arguments:
+    x    -- (patients x visits x features) observations
+    mask -- (patients x visits) mask of the real visits
+
+    Returns the statistics of the sequences that do not depend on the
+    parameters of a model, used by every EM iteration: 'x' (zero on
+    padded visits), 'x_sq' (its square), 'obs' (the real visits, one per
+    row), 'obs_sq' (their square) and 'scatter' (obs.T obs)
+    """
+    x = np.where(mask[:, :, np.newaxis], x, 0.0)
+    obs = x[mask]
+    return {'x':x, 'x_sq':x**2, 'obs':obs, 'obs_sq':obs**2,
+            'scatter':np.dot(obs.T, obs)}
+
+class GaussianHMM(object):
+    """
+    HMM with K hidden states and a Gaussian emission in every state, with
+    diagonal covariances or one full covariance shared (tied) by all
+    states
+    """
+    def __init__(self, K=3, covariance='diag', max_iter=100, tol=1e-4,
+                 min_covar=1e-3, seed=0, verbose=False):
+        """
+        Keyword Arguments:
+        K          -- Number of hidden states
+        covariance -- 'diag' or 'tied'
+        max_iter   -- Maximum number of EM iterations
+        tol        -- Stop when the log-likelihood improves by less than
+                      this fraction
+        min_covar  -- Added to the variances, to keep them away from zero
+        seed       -- Seed of the initial parameters
+        verbose    -- Print the log-likelihood at every iteration
+        """
+        assert covariance in ['diag', 'tied'], \
+            "Unknown covariance: %s"%covariance
+        self.K = K
+        self.covariance = covariance
+        self.max_iter = max_iter
+        self.tol = tol
+        self.min_covar = min_covar
+        self.seed = seed
+        self.verbose = verbose
+
+    def init_params(self, x, mask):
+        """
+        Start from a few k-means iterations on all the visits, uniform
+        initial probabilities and a random transition matrix
+        """
+        rng = np.random.RandomState(self.seed)
+        obs = x[mask]
+        means = obs[rng.choice(len(obs), self.K, replace=False)]
+        for _ in xrange(10):
+            dist = ((obs[:, np.newaxis, :] - means[np.newaxis])**2).sum(2)
+            nearest = dist.argmin(axis=1)
+            for k in xrange(self.K):
+                if (nearest == k).any():
+                    means[k] = obs[nearest == k].mean(axis=0)
+
+        self.pi = np.ones(self.K)/self.K
+        trans = rng.rand(self.K, self.K) + 1
+        self.A = trans/trans.sum(axis=1)[:, np.newaxis]
+        self.means = means
+        if self.covariance == 'diag':
+            self.covars = np.tile(obs.var(axis=0) + self.min_covar,
+                                  (self.K, 1))
+        else:
+            self.covars = np.cov(obs, rowvar=0) + \
+                self.min_covar*np.eye(obs.shape[1])
+
+    def emission_logprob(self, x, x_sq=None):
+        """
+        Keyword Arguments:
+        x    -- (patients x visits x features) observations
+        x_sq -- x**2, if already computed (see data_stats)
+
+        Returns the (patients x visits x K) log-density of every visit
+        under every state
+        """
+        dim = x.shape[-1]
+        flat = x.reshape(-1, dim)
+        if self.covariance == 'diag':
+            if x_sq is None:
+                x_sq = x**2
+            prec = 1.0/self.covars
+            maha = np.dot(x_sq.reshape(-1, dim), prec.T) - \
+                2*np.dot(flat, (self.means*prec).T) + \
+                (self.means**2*prec).sum(axis=1)
+            logdet = np.log(self.covars).sum(axis=1)
+        else:
+            chol = cholesky(self.covars, lower=True)
+            white = solve_triangular(chol, flat.T, lower=True).T
+            centres = solve_triangular(chol, self.means.T, lower=True).T
+            maha = (white**2).sum(axis=1)[:, np.newaxis] - \
+                2*np.dot(white, centres.T) + (centres**2).sum(axis=1)
+            logdet = 2*np.log(np.diag(chol)).sum()
+        logprob = -0.5*(dim*np.log(2*np.pi) + logdet + maha)
+        return logprob.reshape(x.shape[:-1] + (self.K,))
+
+    def forward_backward(self, x, mask, x_sq=None):
+        """
+        Keyword Arguments:
+        x    -- (patients x visits x features) observations
+        mask -- (patients x visits) mask of the real visits
+        x_sq -- x**2, if already computed (see data_stats)
+
+        Returns the log-likelihood of every sequence, the forward and
+        backward log-messages and the emission log-densities. Padded
+        visits carry the messages of the last real visit unchanged.
+        """
+        log_b = self.emission_logprob(x, x_sq)
+        # states or transitions EM has ruled out have probability zero
+        with np.errstate(divide='ignore'):
+            log_a, log_pi = np.log(self.A), np.log(self.pi)
+        num, length = mask.shape
+
+        alpha = np.empty((num, length, self.K))
+        alpha[:, 0] = log_pi + log_b[:, 0]
+        for t in xrange(1, length):
+            step = logsumexp(alpha[:, t-1, :, np.newaxis] + log_a, axis=1) + \
+                log_b[:, t]
+            alpha[:, t] = np.where(mask[:, t, np.newaxis], step,
+                                   alpha[:, t-1])
+        loglik = logsumexp(alpha[:, -1], axis=1)
+
+        beta = np.zeros((num, length, self.K))
+        for t in xrange(length-2, -1, -1):
+            step = logsumexp(log_a + (log_b[:, t+1] +
+                                      beta[:, t+1])[:, np.newaxis, :],
+                             axis=2)
+            beta[:, t] = np.where(mask[:, t+1, np.newaxis], step,
+                                  beta[:, t+1])
+
+        return loglik, alpha, beta, log_b
+
+    def posteriors(self, x, mask):
+        """
+        Returns the (patients x visits x K) probability of every state at
+        every visit given the whole sequence (zero on padded visits)
+        """
+        loglik, alpha, beta, _ = self.forward_backward(x, mask)
+        gamma = np.exp(alpha + beta - loglik[:, np.newaxis, np.newaxis])
+        return gamma*mask[:, :, np.newaxis]
+
+    def score(self, x, mask):
+        """
+        Returns the log-likelihood of every sequence
+        """
+        return self.forward_backward(x, mask)[0]
+
+    def num_params(self):
+        """
+        Returns the number of free parameters of the fitted model
+        """
+        dim = self.means.shape[1]
+        if self.covariance == 'diag':
+            covars = self.K*dim
+        else:
+            covars = dim*(dim + 1)//2
+        return (self.K - 1) + self.K*(self.K - 1) + self.K*dim + covars
+
+    def viterbi(self, x, mask):
+        """
+        Keyword Arguments:
+        x    -- (patients x visits x features) observations
+        mask -- (patients x visits) mask of the real visits
+
+        Returns the (patients x visits) most likely sequence of states of
+        every patient (-1 on padded visits), and its log-probability
+        """
+        log_b = self.emission_logprob(x)
+        with np.errstate(divide='ignore'):
+            log_a, log_pi = np.log(self.A), np.log(self.pi)
+        num, length = mask.shape
+        rows = np.arange(num)
+
+        # back[n, t, k]: best state at t-1 of patient n, given state k at
+        # t. Padded visits point back to the same state.
+        back = np.empty((num, length, self.K), dtype=int)
+        back[:] = np.arange(self.K)
+        delta = log_pi + log_b[:, 0]
+        for t in xrange(1, length):
+            scores = delta[:, :, np.newaxis] + log_a
+            best = scores.argmax(axis=1)
+            step = scores.max(axis=1) + log_b[:, t]
+            back[:, t] = np.where(mask[:, t, np.newaxis], best, back[:, t])
+            delta = np.where(mask[:, t, np.newaxis], step, delta)
+
+        path = np.empty((num, length), dtype=int)
+        path[:, -1] = delta.argmax(axis=1)
+        for t in xrange(length-1, 0, -1):
+            path[:, t-1] = back[rows, t, path[:, t]]
+        path[~mask] = -1
+        return path, delta.max(axis=1)
+
+    def reorder(self, order):
+        """
+        Renumber the states, in place: state k becomes the old state
+        order[k] (getReordered in hmm.m)
+        """
+        self.pi = self.pi[order]
+        self.A = self.A[np.ix_(order, order)]
+        self.means = self.means[order]
+        if self.covariance == 'diag':
+            self.covars = self.covars[order]
+        return self
+
+    def fit(self, x, mask, stats=None):
+        """
+        Fit the model by Baum-Welch on a batch of sequences
+
+        Keyword Arguments:
+        x     -- (patients x visits x features) observations
+        mask  -- (patients x visits) mask of the real visits
+        stats -- data_stats(x, mask), to share it between several fits of
+                 the same sequences
+
+        Returns self. self.history holds the log-likelihood of the
+        training data at every iteration.
+        """
+        if stats is None:
+            stats = data_stats(x, mask)
+        x, obs = stats['x'], stats['obs']
+        self.init_params(x, mask)
+        self.history = []
+        for iteration in xrange(self.max_iter):
+            # E-step
+            loglik, alpha, beta, log_b = self.forward_backward(x, mask,
+                                                              stats['x_sq'])
+            gamma = np.exp(alpha + beta - loglik[:, np.newaxis, np.newaxis])
+            with np.errstate(divide='ignore'):
+                log_a = np.log(self.A)
+            trans = np.zeros((self.K, self.K))
+            for t in xrange(mask.shape[1]-1):
+                log_xi = alpha[:, t, :, np.newaxis] + log_a + \
+                    (log_b[:, t+1] + beta[:, t+1])[:, np.newaxis, :] - \
+                    loglik[:, np.newaxis, np.newaxis]
+                trans += np.exp(log_xi[mask[:, t+1]]).sum(axis=0)
+
+            total = loglik.sum()
+            self.history.append(total)
+            if self.verbose:
+                print "Iteration %d, loglik = %f"%(iteration+1, total)
+            if iteration > 0 and \
+               total - self.history[-2] < self.tol*abs(self.history[-2]):
+                break
+
+            # M-step
+            weights = gamma[mask]
+            counts = weights.sum(axis=0) + 1e-10
+            self.pi = gamma[:, 0].sum(axis=0)/len(x)
+            self.A = trans/trans.sum(axis=1)[:, np.newaxis]
+            self.means = np.dot(weights.T, obs)/counts[:, np.newaxis]
+            if self.covariance == 'diag':
+                self.covars = np.dot(weights.T, stats['obs_sq']) / \
+                    counts[:, np.newaxis] - self.means**2
+                self.covars = np.maximum(self.covars, 0) + self.min_covar
+            else:
+                self.covars = (stats['scatter'] -
+                               np.dot(self.means.T*counts, self.means)) / \
+                    len(obs) + self.min_covar*np.eye(obs.shape[1])
+
+        return self
+
+def state_dist(labels, path, mask, num_labels, K):
+    """
+    Keyword Arguments:
+    labels     -- (patients x visits) label codes, 1 to num_labels
+    path       -- (patients x visits) state of every visit
+    mask       -- (patients x visits) mask of the real visits
+    num_labels -- Number of labels
+    K          -- Number of states
+
+    Returns the (K x num_labels) distribution of the states of the visits
+    of every label (getStateDist in hmm.m)
+    """
+    labels, path = labels[mask], path[mask]
+    known = (labels > 0)
+    counts = np.bincount((labels[known] - 1)*K + path[known],
+                         minlength=num_labels*K).reshape(num_labels, K)
+    return (counts/np.maximum(counts.sum(axis=1), 1.0)[:, np.newaxis]).T
+
+def state_order(dist):
+    """
+    Keyword Arguments:
+    dist -- (K x labels) distribution from state_dist
+
+    Returns the states from the most NL-like to the most AD-like, by the
+    ratio of the NL and AD columns, as in hmm.m
+    """
+    ratio = (dist[:, 0] + 1)/(dist[:, 2] + 1)
+    return np.argsort(-ratio, kind='mergesort')
+
+def get_folds(num, n_folds=3, seed=None):
+    """
+    Keyword Arguments:
+    num     -- Number of patients
+    n_folds -- Number of folds
+    seed    -- Seed of the permutation of the patients (default: random)
+
+    Returns a list of (train, test) index arrays. As in hmm.m, fold f
+    tests on the f-th block of num/n_folds patients of a random
+    permutation; the remainder is always trained on.
+    """
+    idx = np.random.RandomState(seed).permutation(num)
+    size = num//n_folds
+    folds = []
+    for fold in xrange(n_folds):
+        test = idx[size*fold:min(size*(fold+1), num)]
+        folds.append((np.setdiff1d(idx, test), test))
+    return folds
+
+def fit_fold(args):
+    """
+    Fit one model on the training patients of a fold
+
+    Keyword Arguments:
+    args -- (seqs, train, test, params): the sequences, the patients of
+            the fold, and the parameters of GaussianHMM
+
+    Returns the model, with its states ordered from NL to AD on the
+    training patients, and the log-likelihood of every training and
+    testing sequence
+    """
+    seqs, train, test, params = args
+    model = GaussianHMM(**params).fit(seqs['x'][train], seqs['mask'][train])
+    path, _ = model.viterbi(seqs['x'][train], seqs['mask'][train])
+    dist = state_dist(seqs['labels'][train], path, seqs['mask'][train],
+                      len(seqs['label_names']), model.K)
+    model.reorder(state_order(dist))
+    return (model, model.score(seqs['x'][train], seqs['mask'][train]),
+            model.score(seqs['x'][test], seqs['mask'][test]))
+
+def fit_folds(seqs, K=3, n_folds=3, seed=None, n_jobs=None, **params):
+    """
+    Train a model on every fold of the patients, as hmm.m
+
+    Keyword Arguments:
+    seqs    -- Sequences from get_sequences
+    K       -- Number of hidden states
+    n_folds -- Number of folds
+    seed    -- Seed of the folds and of the models (default: random)
+    n_jobs  -- Number of processes, one fold each (default: one per core)
+    params  -- Other parameters of GaussianHMM
+
+    Returns a list with a dict for every fold: 'model', 'train' and
+    'test' (the patients), 'train_ll' and 'test_ll' (log-likelihood of
+    their sequences)
+    """
+    if seed is None:
+        seed = np.random.randint(2**30)
+    if n_jobs is None:
+        n_jobs = mp.cpu_count()
+    params = dict(params, K=K, seed=seed)
+    folds = get_folds(len(seqs['rid']), n_folds, seed)
+    args = [(seqs, train, test, params) for train, test in folds]
+    for fold, (train, test) in enumerate(folds):
+        print "Fold %d: %d training, %d testing"%(fold+1, len(train),
+                                                  len(test))
+    sys.stdout.flush()
+
+    if n_jobs == 1:
+        fitted = map(fit_fold, args)
+    else:
+        pool = mp.Pool(min(n_jobs, n_folds))
+        try:
+            fitted = pool.map(fit_fold, args)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [{'model':model, 'train':train, 'test':test,
+             'train_ll':train_ll, 'test_ll':test_ll}
+            for (model, train_ll, test_ll), (train, test)
+            in zip(fitted, folds)]
+
+def decode(model, seqs, patients=None):
+    """
+    Decode a batch of patients with one forward-backward and one Viterbi
+    pass
+
+    Keyword Arguments:
+    model    -- A fitted GaussianHMM
+    seqs     -- Sequences from get_sequences
+    patients -- Indices of the patients (default: all)
+
+    Returns a dict with 'path' (patients x visits, the Viterbi states),
+    'prob' (patients x visits x K, the probability of every state) and
+    'features', a table of the RID of every patient, the state
+    probabilities at their last visit (S1 to SK) and the DX, MMSE and CDR
+    of that visit
+    """
+    if patients is None:
+        patients = np.arange(len(seqs['rid']))
+    x, mask = seqs['x'][patients], seqs['mask'][patients]
+    path, _ = model.viterbi(x, mask)
+    prob = model.posteriors(x, mask)
+
+    rows = np.arange(len(patients))
+    last = seqs['lengths'][patients] - 1
+    features = pd.DataFrame(prob[rows, last],
+                            columns=['S%d'%(k+1) for k in xrange(model.K)])
+    # a patient is in the training rows of several folds
+    features.insert(0, 'RID', seqs['rid'][patients])
+    features['DX'] = seqs['labels'][patients][rows, last]
+    features['MMSE'] = seqs['mmse'][patients][rows, last]
+    features['CDR'] = seqs['cdr'][patients][rows, last]
+    return {'path':path, 'prob':prob, 'features':features}
+
+def write_viterbi_prob(folds, seqs, out_dir='..'):
+    """
+    Write the HMM features of the training and testing patients of every
+    fold to viterbi_prob_train.csv and viterbi_prob_test.csv, as
+    writeViterbiProb.m, with a header and the RID of every row for
+    classifier.py. Every fold is decoded and appended in turn, so the
+    files are rewritten in one pass over the folds whenever the models
+    change.
+
+    Keyword Arguments:
+    folds   -- Folds from fit_folds
+    seqs    -- The sequences the folds were fitted on
+    out_dir -- Directory of the files
+
+    Returns the paths of the files written
+    """
+    paths = []
+    for name in ['train', 'test']:
+        path = os.path.join(out_dir, 'viterbi_prob_%s.csv'%name)
+        with open(path, 'w') as handle:
+            for num, fold in enumerate(folds):
+                decoded = decode(fold['model'], seqs, fold[name])
+                decoded['features'].to_csv(handle, header=(num == 0),
+                                           index=False)
+        paths.append(path)
+    return paths
+
+def train_hmm(K=6, label_names=LABEL_NAMES, n_folds=3, seed=None,
+              n_jobs=None, out_dir='..', **params):
+    """
+    Train the HMMs of the PET data and write their features, as
+    doTrainHMM.m
+
+    Keyword Arguments:
+    K           -- Number of hidden states
+    label_names -- See get_label_codes
+    n_folds     -- Number of folds
+    seed        -- Seed of the folds and of the models (default: random)
+    n_jobs      -- Number of processes (default: one per core)
+    out_dir     -- Directory of the viterbi_prob_*.csv files
+    params      -- Other parameters of GaussianHMM
+
+    Returns the folds, from fit_folds
+    """
+    seqs = get_sequences(label_names=label_names)
+    print "Training PET HMM"
+    folds = fit_folds(seqs, K, n_folds, seed, n_jobs, **params)
+    write_viterbi_prob(folds, seqs, out_dir)
+    return folds
+
+# data of the workers of select_k
+SHARED = {}
+
+def init_worker(x, mask, folds, params):
+    """
+    Attach a worker of select_k to the sequences, and slice the training
+    and testing patients of every fold, with the data_stats of the
+    training patients, once for all its units
+
+    Keyword Arguments:
+    x      -- Shared observations (as made by cross_val.share_array)
+    mask   -- Shared mask of the real visits
+    folds  -- (train, test) patients of every fold
+    params -- Parameters of GaussianHMM
+    """
+    x, mask = cv.attach_array(*x), cv.attach_array(*mask)
+    SHARED['folds'] = [(x[train], mask[train], x[test], mask[test])
+                       for train, test in folds]
+    SHARED['stats'] = [data_stats(x_train, mask_train)
+                       for x_train, mask_train, _, _ in SHARED['folds']]
+    SHARED['params'] = params
+
+def fit_restarts(unit):
+    """
+    Fit the models of one number of states on one fold, restarting from
+    new initial parameters until one converges to the best training
+    log-likelihood so far again (within params['tol'])
+
+    Keyword Arguments:
+    unit -- (K, fold, number of restarts, seed)
+
+    Returns unit, the training and testing log-likelihood of the best
+    model, its number of parameters and the number of restarts run
+    """
+    K, fold, n_restarts, seed = unit
+    x_train, mask_train, x_test, mask_test = SHARED['folds'][fold]
+    params = dict(SHARED['params'], K=K)
+    tol = params.get('tol', 1e-4)
+    best = None
+    for restart in xrange(n_restarts):
+        model = GaussianHMM(**dict(params, seed=seed + restart))
+        model.fit(x_train, mask_train, SHARED['stats'][fold])
+        train_ll = model.history[-1]
+        if best is not None and \
+           abs(train_ll - best[1]) < tol*abs(best[1]):
+            break
+        if best is None or train_ll > best[1]:
+            best = (model, train_ll)
+    model, train_ll = best
+    return (unit, train_ll, model.score(x_test, mask_test).sum(),
+            model.num_params(), restart + 1)
+
+def select_k(seqs=None, K_range=range(2, 11), n_restarts=5, n_folds=3,
+             seed=None, n_jobs=None, **params):
+    """
+    Compare the number of states of the HMM on the folds of hmm.m
+
+    Keyword Arguments:
+    seqs       -- Sequences from get_sequences (default: all patients)
+    K_range    -- The numbers of states to try
+    n_restarts -- Maximum number of restarts of every model
+    n_folds    -- Number of folds
+    seed       -- Seed of the folds and of the models (default: random)
+    n_jobs     -- Number of worker processes (default: one per core)
+    params     -- Other parameters of GaussianHMM
+
+    Returns a dict with 'K', and (len(K_range) x n_folds) arrays of
+    'test_ll' (held-out log-likelihood per visit), 'train_ll', 'bic' and
+    'aic' (on the training visits) and 'restarts'. Prints them with the
+    K of the best held-out log-likelihood.
+    """
+    if seqs is None:
+        seqs = get_sequences()
+    if seed is None:
+        seed = np.random.randint(2**30)
+    if n_jobs is None:
+        n_jobs = mp.cpu_count()
+    folds = get_folds(len(seqs['rid']), n_folds, seed)
+    units = [(K, fold, n_restarts, seed) for K in K_range
+             for fold in xrange(n_folds)]
+    initargs = (cv.share_array(seqs['x']), cv.share_array(seqs['mask']),
+                folds, params)
+
+    if n_jobs == 1:
+        init_worker(*initargs)
+        fitted = map(fit_restarts, units)
+    else:
+        # the largest models first, so that they do not finish last
+        pool = mp.Pool(n_jobs, init_worker, initargs)
+        try:
+            fitted = pool.map(fit_restarts, units[::-1], 1)[::-1]
+        finally:
+            pool.close()
+            pool.join()
+
+    shape = (len(K_range), n_folds)
+    result = dict((name, np.zeros(shape)) for name in
+                  ['train_ll', 'test_ll', 'bic', 'aic', 'restarts'])
+    result['K'] = np.array(K_range)
+    for ((K, fold, _, _), train_ll, test_ll, num_params, restarts), idx \
+        in zip(fitted, np.ndindex(*shape)):
+        train, test = folds[fold]
+        num_visits = seqs['mask'][train].sum()
+        result['train_ll'][idx] = train_ll/num_visits
+        result['test_ll'][idx] = test_ll/seqs['mask'][test].sum()
+        result['bic'][idx] = -2*train_ll + num_params*np.log(num_visits)
+        result['aic'][idx] = -2*train_ll + 2*num_params
+        result['restarts'][idx] = restarts
+
+    print "%4s %12s %12s %12s %12s %9s"%('K', 'Train LL', 'Test LL', 'BIC',
+                                        'AIC', 'Restarts')
+    for num, K in enumerate(K_range):
+        print "%4d %12.3f %12.3f %12.1f %12.1f %9.1f"%(
+            K, result['train_ll'][num].mean(), result['test_ll'][num].mean(),
+            result['bic'][num].mean(), result['aic'][num].mean(),
+            result['restarts'][num].mean())
+    print "Best K: %d (test LL), %d (BIC), %d (AIC)"%(
+        K_range[result['test_ll'].mean(axis=1).argmax()],
+        K_range[result['bic'].mean(axis=1).argmin()],
+        K_range[result['aic'].mean(axis=1).argmin()])
+    return result
+
+def model_digest(model):
+    """
+    Returns a hex digest of the parameters of a GaussianHMM
+    """
+    return scheduler.data_digest(model.pi, model.A, model.means,
+                                 model.covars)
+
+class FilterStore(object):
+    """
+    The filtered state distribution of every patient (the normalised
+    forward message at their last visit), kept on disk so that a new
+    visit updates one patient instead of decoding everybody again
+    """
+    def __init__(self, model, path=None):
+        """
+        Keyword Arguments:
+        model -- A fitted GaussianHMM, with its states ordered from NL to
+                 AD (see fit_fold)
+        path  -- File of the store (default: in CACHE_DIR, named by the
+                 parameters of the model, so that a new model starts a
+                 new store)
+        """
+        if path is None:
+            path = os.path.join(CACHE_DIR,
+                                'hmm_filter-%s.npz'%model_digest(model))
+        self.model = model
+        self.path = path
+        # rid: [state probabilities, log-likelihood, number of visits]
+        self.patients = {}
+        if os.path.exists(path):
+            with np.load(path) as stored:
+                for rid, prob, loglik, visits in zip(stored['rid'],
+                                                     stored['prob'],
+                                                     stored['loglik'],
+                                                     stored['visits']):
+                    self.patients[rid] = [prob, loglik, visits]
+
+    def add_sequences(self, seqs, patients=None):
+        """
+        Filter the visits of a batch of patients, replacing what is
+        stored for them
+
+        Keyword Arguments:
+        seqs     -- Sequences from get_sequences
+        patients -- Indices of the patients (default: all)
+        """
+        if patients is None:
+            patients = np.arange(len(seqs['rid']))
+        loglik, alpha, _, _ = self.model.forward_backward(
+            seqs['x'][patients], seqs['mask'][patients])
+        # padded visits carry the message of the last visit to the end
+        prob = np.exp(alpha[:, -1] - loglik[:, np.newaxis])
+        for rid, row, ll, visits in zip(seqs['rid'][patients], prob, loglik,
+                                        seqs['lengths'][patients]):
+            self.patients[rid] = [row, ll, visits]
+
+    def update(self, rid, x, horizon=1):
+        """
+        Add one visit of a patient, in O(K^2) plus the emission density
+
+        Keyword Arguments:
+        rid     -- The patient, new or already stored
+        x       -- Mean uptake of every region at the visit, in the order
+                   of the features of get_sequences
+        horizon -- Number of visits ahead for the conversion risk
+
+        Returns the probability of every state at the visit, and the
+        conversion risk (see risk)
+        """
+        log_b = self.model.emission_logprob(
+            np.asarray(x, dtype=float).reshape(1, 1, -1))[0, 0]
+        if rid in self.patients:
+            prob, loglik, visits = self.patients[rid]
+            prior = np.dot(prob, self.model.A)
+        else:
+            prior, loglik, visits = self.model.pi, 0.0, 0
+        top = log_b.max()
+        joint = prior*np.exp(log_b - top)
+        total = joint.sum()
+        prob = joint/total
+        self.patients[rid] = [prob, loglik + np.log(total) + top, visits + 1]
+        return prob, self.risk(rid, horizon)
+
+    def risk(self, rid, horizon=1):
+        """
+        Returns the probability that the patient is in the most AD-like
+        state (the last one) horizon visits after the last one stored
+        """
+        prob = self.patients[rid][0]
+        step = np.linalg.matrix_power(self.model.A, horizon)
+        return np.dot(prob, step)[-1]
+
+    def save(self):
+        """
+        Write the store to self.path
+        """
+        if not os.path.isdir(os.path.dirname(os.path.abspath(self.path))):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)))
+        rid = sorted(self.patients)
+        arrays = {'rid':np.array(rid),
+                  'prob':np.array([self.patients[r][0] for r in rid]),
+                  'loglik':np.array([self.patients[r][1] for r in rid]),
+                  'visits':np.array([self.patients[r][2] for r in rid])}
+        with atomic_path(self.path) as tmp, open(tmp, 'wb') as handle:
+            np.savez(handle, **arrays)
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['select']:
+        select_k()
+    else:
+        train_hmm()
@@ -0,0 +1,163 @@
+"""
+Load the ADNI source tables, and the frames derived from them, on a pool
+of threads
+
+Every table is a node of a dependency graph, loaded through its memoized
+accessor (get_dxsum, get_fdg, ...) so that later calls to the accessor
+get the loaded frame back. A node starts as soon as the nodes it depends
+on are loaded, so a cold start takes about as long as the slowest chain
+of reads and cleans rather than the sum of all of them.
+
+"""
+
+import sys
+import time
+import Queue
+from multiprocessing.pool import ThreadPool
+
+import patient_info as pi
+import read_pet as pet
+import read_mri as mri
+import read_clinical as clinical
+import read_csf as csf
+
+def csf_loader(csf_file):
+    """
+    Returns a function loading one of csf.CSF_FILES
+    """
+    return lambda: csf.get_csf_file(csf_file)
+
+# (name, accessor, names of the nodes it depends on)
+TABLES = [('DXSUM', pi.get_dxsum, []),
+          ('ARM', pi.get_arm, []),
+          ('REG', pi.get_reg, []),
+          ('BASE_DATA', pi.get_base_data, ['DXSUM', 'ARM']),
+          ('DXARM', pi.get_dxarm, ['DXSUM', 'ARM', 'BASE_DATA']),
+          ('DXARM_REG', pi.get_dxarm_reg, ['DXARM', 'REG']),
+          ('FDG', pet.get_fdg, []),
+          ('AV45', pet.get_av, []),
+          ('FSX', mri.get_fsx, []),
+          ('FSX51', mri.get_fsx_51, []),
+          ('MMSE', clinical.get_mmse, []),
+          ('CDR', clinical.get_cdr, [])] +\
+         [(csf_file, csf_loader(csf_file), [])
+          for csf_file in csf.CSF_FILES] +\
+         [('CSF', csf.get_csf, list(csf.CSF_FILES))]
+
+# tables no analysis needs, loaded only when asked for by name
+OPTIONAL_TABLES = [('DATADIC', pi.get_data_dict, [])]
+
+def required(names, graph):
+    """
+    Keyword Arguments:
+    names -- The nodes wanted
+    graph -- dict of name: (accessor, dependencies)
+
+    Returns the wanted nodes and all the nodes they depend on
+    """
+    wanted = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        assert name in graph, "Unknown table: %s"%name
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(graph[name][1])
+    return wanted
+
+def run_node(name, func):
+    """
+    Load one node, catching any error so that it reaches the caller
+
+    Returns (name, start time, end time, exception info or None)
+    """
+    start = time.time()
+    try:
+        func()
+    except Exception:
+        return name, start, time.time(), sys.exc_info()
+    return name, start, time.time(), None
+
+def load(names=None, n_jobs=8, show=True):
+    """
+    Keyword Arguments:
+    names  -- The tables to load, with their dependencies (default: all
+              of TABLES, none of OPTIONAL_TABLES)
+    n_jobs -- Number of threads
+    show   -- Print the timings
+
+    Returns a dict of name: (start, end) of every node loaded, in seconds
+    since the start of the load
+    """
+    graph = dict((name, (func, deps))
+                 for name, func, deps in TABLES + OPTIONAL_TABLES)
+    if names is None:
+        names = [name for name, _, _ in TABLES]
+    wanted = required(names, graph)
+
+    waiting = dict((name, set(graph[name][1])) for name in wanted)
+    finished = Queue.Queue()
+    timings = {}
+    pool = ThreadPool(n_jobs)
+    begin = time.time()
+    try:
+        running = 0
+        while waiting or running:
+            ready = [name for name, deps in waiting.items() if not deps]
+            for name in ready:
+                del waiting[name]
+                pool.apply_async(run_node, (name, graph[name][0]),
+                                 callback=finished.put)
+                running += 1
+
+            name, start, end, error = finished.get()
+            running -= 1
+            if error is not None:
+                raise error[0], error[1], error[2]
+            timings[name] = (start - begin, end - begin)
+            for deps in waiting.values():
+                deps.discard(name)
+    finally:
+        pool.close()
+        pool.join()
+    total = time.time() - begin
+
+    if show:
+        report(timings, total, graph)
+    return timings
+
+def report(timings, total, graph):
+    """
+    Print the time taken by every node, the total time and the longest
+    chain of dependent nodes
+
+    Keyword Arguments:
+    timings -- dict of name: (start, end), as returned by load
+    total   -- Wall time of the load
+    graph   -- dict of name: (accessor, dependencies)
+    """
+    chain = {}
+    def chain_time(name):
+        """
+        Time of the slowest chain of nodes ending at name
+        """
+        if name not in chain:
+            start, end = timings[name]
+            chain[name] = end - start + max([chain_time(dep)
+                                             for dep in graph[name][1]] +
+                                            [0.0])
+        return chain[name]
+
+    print "%-26s %8s %8s %8s"%('Table', 'Start', 'End', 'Time')
+    for name, (start, end) in sorted(timings.items(),
+                                     key=lambda item: item[1]):
+        print "%-26s %8.2f %8.2f %8.2f"%(name, start, end, end - start)
+    longest = max(timings, key=chain_time)
+    print "Loaded %d tables in %.2fs (%.2fs one after another, slowest "\
+        "chain %.2fs ending at %s)"%(len(timings), total,
+                                     sum(end - start for start, end
+                                         in timings.values()),
+                                     chain[longest], longest)
+
+if __name__ == '__main__':
+    load()
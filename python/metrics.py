@@ -0,0 +1,128 @@
+"""
+Classification metrics of all the (repetition, fold) pairs of a repeated
+k-fold CV at once
+
+The out-of-fold decision values of every repetition are stacked in one
+(repetitions x samples) array, as kept by cross_val.cross_validate, and
+every metric is computed for all folds in a single pass. AUROC is the
+Mann-Whitney statistic: the probability that a positive sample scores
+above a negative one, with ties counting one half.
+
+"""
+
+import numpy as np
+from scipy import stats
+
+METRICS = ['auroc', 'accuracy', 'sensitivity', 'specificity']
+
+def group_ids(folds):
+    """
+    Keyword Arguments:
+    folds -- (repetitions x samples) fold number of every sample
+
+    Returns the (repetition, fold) group of every sample, numbered
+    rep*n_folds + fold, and n_folds
+    """
+    folds = np.atleast_2d(folds)
+    n_folds = folds.max() + 1
+    rep = np.arange(folds.shape[0])[:, np.newaxis]
+    return (rep*n_folds + folds).ravel(), n_folds
+
+def auroc(y, scores, groups, num_groups):
+    """
+    Keyword Arguments:
+    y          -- Binary label of every score (1 for the positive class)
+    scores     -- Decision values
+    groups     -- Group number of every score
+    num_groups -- Number of groups
+
+    Returns the AUROC of every group (NaN for groups missing a class)
+    """
+    order = np.lexsort((scores, groups))
+    scores, groups, y = scores[order], groups[order], y[order]
+
+    # average rank of every run of tied scores, counted within the group
+    new_run = np.ones(len(scores), dtype=bool)
+    new_run[1:] = (scores[1:] != scores[:-1]) | (groups[1:] != groups[:-1])
+    run = np.cumsum(new_run) - 1
+    start = np.searchsorted(groups, np.arange(num_groups))
+    position = np.arange(len(scores)) - start[groups] + 1.0
+    rank = (np.bincount(run, weights=position)/np.bincount(run))[run]
+
+    num_pos = np.bincount(groups, weights=y, minlength=num_groups)
+    num_neg = np.bincount(groups, minlength=num_groups) - num_pos
+    rank_sum = np.bincount(groups, weights=rank*y, minlength=num_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (rank_sum - num_pos*(num_pos + 1)/2.0)/(num_pos*num_neg)
+
+def fold_metrics(y, scores, folds, threshold=0.0):
+    """
+    Keyword Arguments:
+    y         -- Binary labels of the samples (1 for the positive class)
+    scores    -- (repetitions x samples) out-of-fold decision values
+    folds     -- (repetitions x samples) fold number of every sample
+    threshold -- Decision value above which a sample is called positive
+
+    Returns a dict of (repetitions x n_folds) arrays, one per name in
+    METRICS
+    """
+    scores = np.atleast_2d(scores)
+    groups, n_folds = group_ids(folds)
+    num_groups = scores.shape[0]*n_folds
+    y = np.tile(np.asarray(y, dtype=int), scores.shape[0])
+    scores = scores.ravel()
+
+    predicted = (scores > threshold).astype(int)
+    num_pos = np.bincount(groups, weights=y, minlength=num_groups)
+    num_neg = np.bincount(groups, weights=1 - y, minlength=num_groups)
+    true_pos = np.bincount(groups, weights=predicted*y,
+                           minlength=num_groups)
+    true_neg = np.bincount(groups, weights=(1 - predicted)*(1 - y),
+                           minlength=num_groups)
+
+    result = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['auroc'] = auroc(y, scores, groups, num_groups)
+        result['accuracy'] = (true_pos + true_neg)/(num_pos + num_neg)
+        result['sensitivity'] = true_pos/num_pos
+        result['specificity'] = true_neg/num_neg
+    for name in METRICS:
+        result[name] = result[name].reshape(-1, n_folds)
+    return result
+
+def summarize(values, level=0.95):
+    """
+    Keyword Arguments:
+    values -- (repetitions x n_folds) metric, e.g. from fold_metrics
+    level  -- Coverage of the confidence interval
+
+    Returns [mean, std, lower, upper]: the mean and standard deviation
+    over all folds, and the t confidence interval of the mean computed
+    from the per-repetition means (folds of one repetition share their
+    training data, so they are not independent)
+    """
+    values = np.atleast_2d(values)
+    rep_mean = np.nanmean(values, axis=1)
+    rep_mean = rep_mean[~np.isnan(rep_mean)]
+    mean = np.nanmean(values)
+    if len(rep_mean) > 1:
+        half = stats.t.ppf(0.5 + level/2.0, len(rep_mean) - 1)*\
+            rep_mean.std(ddof=1)/np.sqrt(len(rep_mean))
+    else:
+        half = np.nan
+    return np.array([mean, np.nanstd(values), mean - half, mean + half])
+
+def report(metrics, header='', level=0.95):
+    """
+    Print the summary of every metric
+
+    Keyword Arguments:
+    metrics -- dict from fold_metrics
+    header  -- Title of the report
+    level   -- Coverage of the confidence intervals
+    """
+    print header
+    for name in METRICS:
+        mean, std, lower, upper = summarize(metrics[name], level)
+        print "  %-12s %.3f +/- %.3f (%d%% CI: %.3f-%.3f)"%(
+            name+":", mean, std, int(round(level*100)), lower, upper)
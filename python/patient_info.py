@@ -8,7 +8,9 @@ belonging to a particular class (AD/CN/MCIc/MCInc)
 
 import pandas as pd
 import numpy as np
-from read import read
+from read import read, memoize, cache_arrays
+from schema import compact
+import schema
 import matplotlib.pyplot as plt
 
 BASE_DIR = '/phobos/alzheimers/adni/'
@@ -25,10 +27,8 @@ ARM_FILE = BASE_DIR + 'ARM.csv'
 # data file for the Registries
 REG_FILE = BASE_DIR + 'REGISTRY.csv'
 
-DXSUM = read(DXSUM_FILE)
-DICT = read(DATADIC_FILE)
-ARM = read(ARM_FILE)
-REG = read(REG_FILE)
+# the tables the diagnoses are derived from
+DX_FILES = [DXSUM_FILE, ARM_FILE, REG_FILE]
 
 """
 1: Normal
@@ -57,205 +57,380 @@ MCI_NL = 7
 AD_MCI = 8
 AD_NL = 9
 
-# make the ADNI1 variables compatible with those in ADNIGO/2
-DXSUM.loc[(DXSUM['DXCONV'] == 0) &
-          (DXSUM['DXCURREN'] == 1), 'DXCHANGE'] = NL_NL
-DXSUM.loc[(DXSUM['DXCONV'] == 0) &
-          (DXSUM['DXCURREN'] == 2), 'DXCHANGE'] = MCI_MCI
-DXSUM.loc[(DXSUM['DXCONV'] == 0) &
-          (DXSUM['DXCURREN'] == 3), 'DXCHANGE'] = AD_AD
-DXSUM.loc[(DXSUM['DXCONV'] == 1) &
-          (DXSUM['DXCONTYP'] == 1), 'DXCHANGE'] = NL_MCI
-DXSUM.loc[(DXSUM['DXCONV'] == 1) &
-          (DXSUM['DXCONTYP'] == 3), 'DXCHANGE'] = MCI_AD
-DXSUM.loc[(DXSUM['DXCONV'] == 1) &
-          (DXSUM['DXCONTYP'] == 2), 'DXCHANGE'] = NL_AD
-DXSUM.loc[(DXSUM['DXCONV'] == 2) &
-          (DXSUM['DXREV'] == 1), 'DXCHANGE'] = MCI_NL
-DXSUM.loc[(DXSUM['DXCONV'] == 2) &
-          (DXSUM['DXREV'] == 2), 'DXCHANGE'] = AD_MCI
-DXSUM.loc[(DXSUM['DXCONV'] == 2) &
-          (DXSUM['DXREV'] == 3), 'DXCHANGE'] = AD_NL
-
-# merge ARM data with DXSUM. ADNI Training slides 2
-DXARM = pd.merge(DXSUM[['RID', 'Phase', 'VISCODE', 'VISCODE2', 'DXCHANGE']],
-                 ARM[['RID', 'Phase', 'ARM', 'ENROLLED']],
-                 on=['RID', 'Phase'])
-
-BASE_DATA = DXARM.loc[(DXARM['VISCODE2'] == 'bl') &
-                      DXARM['ENROLLED'].isin([1, 2, 3])]
-BASE_DATA.loc[(BASE_DATA['DXCHANGE'].isin([1, 7, 9])) &
-              ~(BASE_DATA['ARM'] == 11), 'DXBASELINE'] = NORMAL
-BASE_DATA.loc[(BASE_DATA['DXCHANGE'].isin([1, 7, 9])) &
-              (BASE_DATA['ARM'] == 11), 'DXBASELINE'] = SMC
-BASE_DATA.loc[(BASE_DATA['DXCHANGE'].isin([2, 4, 8])) &
-              (BASE_DATA['ARM'] == 10), 'DXBASELINE'] = EMCI
-BASE_DATA.loc[(BASE_DATA['DXCHANGE'].isin([2, 4, 8])) &
-              ~(BASE_DATA['ARM'] == 10), 'DXBASELINE'] = LMCI
-BASE_DATA.loc[BASE_DATA['DXCHANGE'].isin([3, 5, 6]),
-              'DXBASELINE'] = AD
-DXARM = pd.merge(DXARM, BASE_DATA[['RID', 'DXBASELINE']], on='RID')
-
-DXARM_REG = pd.merge(DXARM, REG[['RID', 'Phase', 'VISCODE', 'VISCODE2',
-                                 'EXAMDATE', 'PTSTATUS', 'RGCONDCT',
-                                 'RGSTATUS', 'VISTYPE']],
-                     on=['RID', 'Phase', 'VISCODE', 'VISCODE2'])
-
-def clean_visits(data):
+@memoize
+def get_dxsum():
     """
+    Diagnostic summary, with the ADNI1 variables made compatible with
+    those in ADNIGO/2
+    """
+    dxsum = read(DXSUM_FILE)
+    dxsum.loc[(dxsum['DXCONV'] == 0) &
+              (dxsum['DXCURREN'] == 1), 'DXCHANGE'] = NL_NL
+    dxsum.loc[(dxsum['DXCONV'] == 0) &
+              (dxsum['DXCURREN'] == 2), 'DXCHANGE'] = MCI_MCI
+    dxsum.loc[(dxsum['DXCONV'] == 0) &
+              (dxsum['DXCURREN'] == 3), 'DXCHANGE'] = AD_AD
+    dxsum.loc[(dxsum['DXCONV'] == 1) &
+              (dxsum['DXCONTYP'] == 1), 'DXCHANGE'] = NL_MCI
+    dxsum.loc[(dxsum['DXCONV'] == 1) &
+              (dxsum['DXCONTYP'] == 3), 'DXCHANGE'] = MCI_AD
+    dxsum.loc[(dxsum['DXCONV'] == 1) &
+              (dxsum['DXCONTYP'] == 2), 'DXCHANGE'] = NL_AD
+    dxsum.loc[(dxsum['DXCONV'] == 2) &
+              (dxsum['DXREV'] == 1), 'DXCHANGE'] = MCI_NL
+    dxsum.loc[(dxsum['DXCONV'] == 2) &
+              (dxsum['DXREV'] == 2), 'DXCHANGE'] = AD_MCI
+    dxsum.loc[(dxsum['DXCONV'] == 2) &
+              (dxsum['DXREV'] == 3), 'DXCHANGE'] = AD_NL
+    return compact(dxsum, schema.DXSUM)
+
+@memoize
+def get_data_dict():
+    """
+    Data dictionary for all ADNI data
+    """
+    return read(DATADIC_FILE)
+
+@memoize
+def get_arm():
+    """
+    ARM assignments
+    """
+    return compact(read(ARM_FILE), schema.ARM)
+
+@memoize
+def get_reg():
+    """
+    Registries
+    """
+    return compact(read(REG_FILE), schema.REG)
+
+def merge_dxsum_arm():
+    """
+    Merge ARM data with DXSUM. ADNI Training slides 2
+    """
+    return pd.merge(get_dxsum()[['RID', 'Phase', 'VISCODE', 'VISCODE2',
+                                 'DXCHANGE']],
+                    get_arm()[['RID', 'Phase', 'ARM', 'ENROLLED']],
+                    on=['RID', 'Phase'])
+
+@memoize
+def get_base_data():
+    """
+    Baseline visits of enrolled patients, labelled with the baseline
+    diagnosis
+    """
+    dxarm = merge_dxsum_arm()
+    base_data = dxarm.loc[(dxarm['VISCODE2'] == 'bl') &
+                          dxarm['ENROLLED'].isin([1, 2, 3])]
+    base_data.loc[(base_data['DXCHANGE'].isin([1, 7, 9])) &
+                  ~(base_data['ARM'] == 11), 'DXBASELINE'] = NORMAL
+    base_data.loc[(base_data['DXCHANGE'].isin([1, 7, 9])) &
+                  (base_data['ARM'] == 11), 'DXBASELINE'] = SMC
+    base_data.loc[(base_data['DXCHANGE'].isin([2, 4, 8])) &
+                  (base_data['ARM'] == 10), 'DXBASELINE'] = EMCI
+    base_data.loc[(base_data['DXCHANGE'].isin([2, 4, 8])) &
+                  ~(base_data['ARM'] == 10), 'DXBASELINE'] = LMCI
+    base_data.loc[base_data['DXCHANGE'].isin([3, 5, 6]),
+                  'DXBASELINE'] = AD
+    return base_data
+
+@memoize
+def get_dxarm():
+    """
+    Diagnostic summary merged with the ARM data and the baseline diagnosis
+    """
+    return pd.merge(merge_dxsum_arm(), get_base_data()[['RID', 'DXBASELINE']],
+                    on='RID')
+
+@memoize
+def get_dxarm_reg():
+    """
+    Diagnosis, ARM and baseline diagnosis of every visit, merged with the
+    Registry information for that visit
+    """
+    reg = get_reg()
+    merged = pd.merge(get_dxarm(), reg[['RID', 'Phase', 'VISCODE', 'VISCODE2',
+                                        'EXAMDATE', 'PTSTATUS', 'RGCONDCT',
+                                        'RGSTATUS', 'VISTYPE']],
+                      on=['RID', 'Phase', 'VISCODE', 'VISCODE2'])
+    return compact(merged, schema.DXARM_REG)
+
+def clean_visits(data, inplace=False, screening=False):
+    """
+    Fill in a missing VISCODE2 with the VISCODE of the same visit
+
     Keyword Arguments:
-    data -- The data-frame to clean
+    data      -- The data-frame to clean
+    inplace   -- Modify data itself instead of a copy
+    screening -- Also relabel screening visits ('sc') as baseline ('bl')
     """
-    result = data['VISCODE2'].isnull()
-    for i in xrange(len(result)):
-        if result[i]:
-            data.loc[i, 'VISCODE2'] = data.loc[i, 'VISCODE']
+    if not inplace:
+        data = data.copy()
+
+    if 'VISCODE2' in data.columns:
+        # aligned on the index, so any index will do
+        data['VISCODE2'] = data['VISCODE2'].fillna(data['VISCODE'])
+    else:
+        data['VISCODE2'] = data['VISCODE']
+
+    if screening:
+        data.loc[data['VISCODE2'] == 'sc', 'VISCODE2'] = 'bl'
 
     return data
 
-def get_dx(data):
+# columns added to a table by get_dx_with_time (get_dx omits CONVTIME)
+DX_COLUMNS = ['DXCHANGE', 'DXBASELINE', 'CONVTIME']
+
+def dx_names(dxchange):
     """
     Keyword Arguments:
-    data -- The data we want Diagnoisis information for
+    dxchange -- DXCHANGE codes
 
-    Returns the new dataframe with DX info.
+    Returns the current diagnosis ('NL', 'MCI' or 'AD', '' if unknown) of
+    every code
     """
-    merged = pd.merge(data, DXARM_REG, on=['RID', 'VISCODE2'],
-                      how='inner')
+    names = np.empty(len(dxchange), dtype='S3')
+    names.fill('')
+    names[np.in1d(dxchange, [1, 7, 9])] = 'NL'
+    names[np.in1d(dxchange, [2, 4, 8])] = 'MCI'
+    names[np.in1d(dxchange, [3, 5, 6])] = 'AD'
+    return names
+
+@cache_arrays('dx_lookup', DX_FILES)
+def build_dx_lookup(days):
+    """
+    Build the arrays of get_dx_lookup
+    """
+    dxarm_reg = get_dxarm_reg()
+    convtime = get_time_to_conversion(dxarm_reg, days).values
+    rid = dxarm_reg['RID'].values.astype(np.int64)
+    visit = dxarm_reg['VISCODE2'].astype(str).values.astype('S')
+    order = np.lexsort((visit, rid))
+
+    return (rid[order], visit[order],
+            dxarm_reg['DXCHANGE'].values[order],
+            dxarm_reg['DXBASELINE'].values[order], convtime[order],
+            dx_names(dxarm_reg['DXCHANGE'].values)[order],
+            np.array([str(col) for col in dxarm_reg.columns], dtype='S'))
+
+@memoize
+def get_dx_lookup(days=False):
+    """
+    Keyword Arguments:
+    days -- Measure the time to conversion in days instead of months
 
-    cols = []
-    for column in data.columns:
-        if column in merged.columns:
-            cols.append(column)
+    Returns the diagnosis of every visit of DXARM_REG as a dict of arrays
+    sorted on (RID, VISCODE2): 'RID', 'VISCODE2', the DX_COLUMNS, 'DX',
+    and 'key' to search them by (see dx_keys). 'columns' holds the
+    columns of DXARM_REG. The arrays are built once per release of the
+    source tables and kept in read.CACHE_DIR.
+    """
+    arrays = build_dx_lookup(days)
+    lookup = dict(zip(['RID', 'VISCODE2'] + DX_COLUMNS + ['DX', 'columns'],
+                      arrays))
+    lookup['visits'] = np.unique(lookup['VISCODE2'])
+    lookup['key'] = dx_keys(lookup, lookup['RID'], lookup['VISCODE2'])
+    return lookup
+
+def dx_keys(lookup, rid, visit):
+    """
+    Keyword Arguments:
+    lookup -- dict from get_dx_lookup
+    rid    -- RIDs of some visits
+    visit  -- VISCODE2 of the same visits
 
-    cols.extend(['DXCHANGE', 'DXBASELINE'])
+    Returns a sorted-search key for every visit, -1 for visit codes not in
+    the lookup
+    """
+    visit = np.asarray(visit).astype('S')
+    code = np.searchsorted(lookup['visits'], visit)
+    code = np.minimum(code, len(lookup['visits']) - 1)
+    known = lookup['visits'][code] == visit
+    key = np.asarray(rid, dtype=np.int64)*len(lookup['visits']) + code
+    key[~known] = -1
+    return key
+
+def enrich(data, columns, days=False):
+    """
+    Add the diagnosis of every visit of data, like an inner join of data
+    and DXARM_REG on (RID, VISCODE2), by binary search in the lookup of
+    get_dx_lookup. Works on any slice of a table, e.g. one chunk of a
+    table read with read(..., chunksize=...).
 
-    merged = merged[cols]
-    merged.loc[merged['DXCHANGE'].isin([1, 7, 9]), 'DX'] = 'NL'
-    merged.loc[merged['DXCHANGE'].isin([2, 4, 8]), 'DX'] = 'MCI'
-    merged.loc[merged['DXCHANGE'].isin([3, 5, 6]), 'DX'] = 'AD'
+    Keyword Arguments:
+    data    -- The table to enrich, with RID and VISCODE2 columns
+    columns -- The DX_COLUMNS to add; 'DX' is always added
+    days    -- Measure the time to conversion in days instead of months
+    """
+    lookup = get_dx_lookup(days)
+    key = dx_keys(lookup, data['RID'].values, data['VISCODE2'].values)
+    start = np.searchsorted(lookup['key'], key, side='left')
+    stop = np.searchsorted(lookup['key'], key, side='right')
+    stop[key < 0] = start[key < 0]
+
+    # every row of data once for each visit it matches, in order
+    lengths = stop - start
+    rows = np.repeat(np.arange(len(data)), lengths)
+    matches = np.arange(lengths.sum()) + np.repeat(start - np.cumsum(lengths)
+                                                   + lengths, lengths)
+
+    # columns of data sharing a name with DXARM_REG are dropped, as a
+    # merge would suffix them
+    shared = set(lookup['columns']) - set(['RID', 'VISCODE2'])
+    cols = [column for column in data.columns if column not in shared]
+    merged = data[cols].iloc[rows].reset_index(drop=True)
+    for column in columns:
+        merged[column] = lookup[column][matches]
+    names = lookup['DX'][matches].astype(object)
+    names[names == ''] = np.nan
+    merged['DX'] = names
 
     return merged
 
-def get_dx_with_time(data):
+def get_dx(data):
+    """
+    Keyword Arguments:
+    data -- The data we want Diagnoisis information for
+
+    Returns the new dataframe with DX info.
+    """
+    return enrich(data, ['DXCHANGE', 'DXBASELINE'])
+
+def get_dx_with_time(data, days=False):
     """
     Keyword Arguments:
     data -- The data we want diagnosis information for along with
             the time to conversion (-1 for no conversion)
+    days -- Measure the time to conversion in days instead of months
     """
-    if not 'CONVTIME' in DXARM_REG:
-        get_time_to_conversion()
-
-    merged = pd.merge(data, DXARM_REG, on=['RID', 'VISCODE2'],
-                      how='inner')
-
-    cols = []
-    for column in data.columns:
-        if column in merged.columns:
-            cols.append(column)
+    return enrich(data, DX_COLUMNS, days)
 
-    cols.extend(['DXCHANGE', 'DXBASELINE', 'CONVTIME'])
-
-    merged = merged[cols]
-    merged.loc[merged['DXCHANGE'].isin([1, 7, 9]), 'DX'] = 'NL'
-    merged.loc[merged['DXCHANGE'].isin([2, 4, 8]), 'DX'] = 'MCI'
-    merged.loc[merged['DXCHANGE'].isin([3, 5, 6]), 'DX'] = 'AD'
-
-    return merged
-
-def get_time_to_conversion():
+def get_time_to_conversion(data=None, days=False):
     """
     Keyword Arguments:
-    data -- Data Frame with EHR info.
+    data -- Data Frame with EHR info. (default: get_dxarm_reg())
+    days -- Measure the time in days instead of months
 
     Label each visit with the time remaining for a NL->MCI or MCI->AD
-    conversion.
+    conversion. Visits before a patient's first NL->MCI conversion are
+    labelled with the time to it, later visits before the first MCI->AD
+    conversion with the time to that.
 
     If no conversion is seen, then value = -1
 
+    Returns a Series aligned with data.
     """
-    DXARM_REG['CONVTIME'] = -1
-    grouped = DXARM_REG.groupby('RID', as_index=False)
-    patients = sorted(grouped.indices.keys())
-
-    for patient in patients:
-        visits = grouped.get_group(patient).sort('EXAMDATE')
-        dxchange = visits['DXCHANGE']
-
-        if MCI_AD in dxchange.values:
-            arg_idx = list(dxchange).index(MCI_AD)
-            idx = dxchange.index[arg_idx]
-            dx_date = pd.to_datetime(DXARM_REG.loc[idx, 'EXAMDATE'])
-            for vis_idx in visits.index[:arg_idx]:
-                cur_date = pd.to_datetime(DXARM_REG.loc[vis_idx, 'EXAMDATE'])
-                DXARM_REG.loc[vis_idx, 'CONVTIME'] = ((dx_date.year-
-                                                       cur_date.year)*12
-                                                      +
-                                                      (dx_date.month-
-                                                       cur_date.month))
-
-        if NL_MCI in dxchange.values:
-            arg_idx = list(dxchange).index(NL_MCI)
-            idx = dxchange.index[arg_idx]
-            dx_date = pd.to_datetime(DXARM_REG.loc[idx, 'EXAMDATE'])
-            for vis_idx in visits.index[:arg_idx]:
-                cur_date = pd.to_datetime(DXARM_REG.loc[vis_idx, 'EXAMDATE'])
-                DXARM_REG.loc[vis_idx, 'CONVTIME'] = ((dx_date.year-
-                                                       cur_date.year)*12
-                                                      +
-                                                      (dx_date.month-
-                                                       cur_date.month))
+    if data is None:
+        data = get_dxarm_reg()
 
-def get_baseline_classes(data, phase=''):
+    dates = pd.DatetimeIndex(data['EXAMDATE'])
+    if days:
+        stamp = dates.values.astype('datetime64[D]').astype(np.int64)
+    else:
+        stamp = dates.year*12 + dates.month
+    stamp = np.asarray(stamp, dtype=float)
+    # visits without an exam date sort last and keep -1
+    dated = ~pd.isnull(dates)
+    stamp[~dated] = np.nan
+
+    # position of every visit once sorted by patient and exam date
+    order = np.lexsort((np.where(dated, dates.asi8, np.iinfo(np.int64).max),
+                        data['RID'].values))
+    pos = np.empty(len(data))
+    pos[order] = np.arange(len(data))
+
+    convtime = np.empty(len(data))
+    convtime.fill(-1)
+    dxchange = data['DXCHANGE'].values
+
+    # NL->MCI goes last so it takes precedence over MCI->AD
+    for event in [MCI_AD, NL_MCI]:
+        first = pd.Series(np.where((dxchange == event) & dated, pos, np.inf),
+                          index=data.index)\
+                  .groupby(data['RID'].values).transform('min').values
+        before = np.isfinite(first) & (pos < first) & dated
+        event_stamp = stamp[order[first[before].astype(int)]]
+        convtime[before] = event_stamp - stamp[before]
+
+    return pd.Series(convtime.astype(int), index=data.index, name='CONVTIME')
+
+# classes returned by get_baseline_classes. 'MCI' is used for MCI patients
+# whose later visits say nothing about conversion
+BASELINE_CLASSES = ['NL', 'MCI', 'MCI-C', 'MCI-NC', 'MCI-REV', 'AD']
+
+@memoize
+def get_baseline_labels(phase=''):
     """
     Keyword Arguments:
-    data -- The data to segment
-    """
-    # store patients in each group
-    dx_base = {}
+    phase -- 'ADNI1' to only label patients with a conducted ADNI1
+             baseline visit
 
-    # RIDs of patients we want to consider
-    # first get all patients belong to the correct phase
-    # and having baseline measurements
-    # then only consider those that have measurements in the data matrix
+    Returns a categorical Series, indexed by RID, with the baseline class
+    of every patient that has one.
+    """
+    dxarm_reg = get_dxarm_reg()
     if phase == 'ADNI1':
-        idx = get_adni1_idx(data)
-        rid = DXARM_REG.loc[idx, 'RID']
-    else:
-        rid = data['RID'].unique()
-
-    for patient in rid:
-        try:
-            info = DXARM_REG[DXARM_REG['RID'] == patient]
-            dx_baseline = info.DXBASELINE.values[0]
-            change = info.DXCHANGE
-            if dx_baseline == NORMAL or dx_baseline == SMC:
-                dx_base[patient] = 'NL' # normal control
-            elif dx_baseline == EMCI or dx_baseline == LMCI:
-                dx_base[patient] = 'MCI' # mild cognitive impairment
-                if MCI_AD in change.values:
-                    dx_base[patient] += '-C'
-                elif MCI_NL in change.values:
-                    dx_base[patient] += '-REV'
-                elif MCI_MCI in change.values:
-                    dx_base[patient] += '-NC'
-            elif dx_baseline == AD:
-                dx_base[patient] = 'AD' # alzheimer's disease
-        except IndexError:
+        rid = dxarm_reg.loc[get_adni1_idx(), 'RID']
+        dxarm_reg = dxarm_reg[dxarm_reg['RID'].isin(rid)]
+
+    grouped = dxarm_reg.groupby('RID')
+    dx_baseline = grouped['DXBASELINE'].first()
+    change = dxarm_reg['DXCHANGE']
+
+    def seen(code):
+        """Whether each patient ever has DXCHANGE == code"""
+        return (change == code).groupby(dxarm_reg['RID']).any()\
+                                .reindex(dx_baseline.index)
+
+    labels = pd.Series(np.nan, index=dx_baseline.index, dtype=object)
+    # normal control
+    labels[dx_baseline.isin([NORMAL, SMC])] = 'NL'
+    # mild cognitive impairment, in reverse order of precedence
+    mci = dx_baseline.isin([EMCI, LMCI])
+    labels[mci] = 'MCI'
+    labels[mci & seen(MCI_MCI)] = 'MCI-NC'
+    labels[mci & seen(MCI_NL)] = 'MCI-REV'
+    labels[mci & seen(MCI_AD)] = 'MCI-C'
+    # alzheimer's disease
+    labels[dx_baseline == AD] = 'AD'
+    labels = labels.dropna()
+
+    return pd.Series(pd.Categorical(labels.values,
+                                    categories=BASELINE_CLASSES),
+                     index=labels.index, name='DX')
+
+def get_baseline_classes(data, phase=''):
+    """
+    Keyword Arguments:
+    data  -- The data to segment
+    phase -- 'ADNI1' to only consider patients with a conducted ADNI1
+             baseline visit
+
+    Returns the baseline class of every patient in data, as a categorical
+    Series indexed by RID.
+    """
+    rid = np.unique(data['RID'])
+    if phase != 'ADNI1':
+        missing = rid[~np.in1d(rid, get_dxarm_reg()['RID'])]
+        for patient in missing:
             print 'WARNING: No diagnostic info. for RID=%d'%patient
 
-    return dx_base
+    labels = get_baseline_labels(phase)
+    return labels[labels.index.isin(rid)]
 
-def get_adni1_idx(data):
+def get_adni1_idx(data=None):
     """
-    Extract from DXARM_REG the indices of the rows that belong only to
+    Extract from get_dxarm_reg() the indices of the rows that belong only to
     ADNI1 patients, and also exist in 'data'
     Keyword Arguments: data -- The data-set we want to
-    consider
+    consider (default: all patients)
 
     """
-    return ((DXARM_REG['Phase'] == 'ADNI1') &
-            (DXARM_REG['VISCODE'] == 'bl') & # belonging to ADNI1
-            (DXARM_REG['RGCONDCT'] == 1) & # was the visit conducted?
-            (DXARM_REG['RID'].isin(data['RID'])))
-
+    dxarm_reg = get_dxarm_reg()
+    idx = ((dxarm_reg['Phase'] == 'ADNI1') &
+           (dxarm_reg['VISCODE'] == 'bl') & # belonging to ADNI1
+           (dxarm_reg['RGCONDCT'] == 1)) # was the visit conducted?
+    if data is not None:
+        idx &= dxarm_reg['RID'].isin(data['RID'])
+    return idx
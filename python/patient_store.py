@@ -0,0 +1,116 @@
+"""
+Indexed access to the rows of a modality table (FDG, FSX, CSF, ...)
+
+The rows are sorted once by patient and visit code, so the rows of a
+patient, or of one visit of many patients, are found by binary search
+instead of a boolean scan of the whole table.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+class PatientStore(object):
+    """
+    A modality table kept sorted on (RID, visit code), with the visit
+    codes stored as categoricals
+    """
+    def __init__(self, data, visit='VISCODE2', baseline='bl'):
+        """
+        Keyword Arguments:
+        data     -- The modality table
+        visit    -- The column holding the visit codes
+        baseline -- The visit code of the baseline visit
+        """
+        self.visit = visit
+        self.baseline_code = baseline
+
+        codes = pd.Categorical(data[visit])
+        self.categories = codes.categories
+        rid = data['RID'].values.astype(np.int64)
+        order = np.lexsort((codes.codes, rid))
+
+        self.data = data.iloc[order].copy()
+        self.data[visit] = codes[order]
+        self.data.index = pd.MultiIndex.from_arrays([self.data['RID'].values,
+                                                     self.data[visit].values],
+                                                    names=['RID', visit])
+
+        # sorted search keys; codes are shifted by one so a missing visit
+        # code (-1) still sorts inside its patient
+        self.width = len(self.categories) + 1
+        self.rid = rid[order]
+        self.key = self.rid*self.width + codes.codes[order] + 1
+
+    def __len__(self):
+        return len(self.data)
+
+    def patients(self):
+        """
+        The RIDs of all patients in the table
+        """
+        return np.unique(self.rid)
+
+    def locate(self, rids, viscode=None):
+        """
+        Keyword Arguments:
+        rids    -- The patients to look up
+        viscode -- Only look up this visit (default: all visits)
+
+        Returns the start and stop positions of the rows of every patient
+        """
+        rids = np.asarray(rids, dtype=np.int64)
+        if viscode is None:
+            keys, wanted = self.rid, rids
+        elif viscode in self.categories:
+            code = self.categories.get_loc(viscode) + 1
+            keys, wanted = self.key, rids*self.width + code
+        else:
+            empty = np.zeros(len(rids), dtype=np.int64)
+            return empty, empty
+
+        return (np.searchsorted(keys, wanted, side='left'),
+                np.searchsorted(keys, wanted, side='right'))
+
+    def count(self, rids, viscode=None):
+        """
+        Keyword Arguments:
+        rids    -- The patients to look up
+        viscode -- Only count this visit (default: all visits)
+
+        Returns the number of rows found for every patient
+        """
+        start, stop = self.locate(rids, viscode)
+        return stop - start
+
+    def take(self, rids, viscode=None):
+        """
+        Keyword Arguments:
+        rids    -- The patients to look up
+        viscode -- Only take this visit (default: all visits)
+
+        Returns the rows of the given patients, in the order of rids
+        """
+        start, stop = self.locate(rids, viscode)
+        lengths = stop - start
+        # concatenate the ranges start[i]:stop[i] without a Python loop
+        offset = np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+        return self.data.iloc[np.arange(lengths.sum()) + offset]
+
+    def visits(self, rid):
+        """
+        Keyword Arguments:
+        rid -- The patient to look up
+
+        Returns all the rows of the patient
+        """
+        return self.take([rid])
+
+    def baseline(self, rid):
+        """
+        Keyword Arguments:
+        rid -- The patient to look up
+
+        Returns the rows of the baseline visit of the patient
+        """
+        return self.take([rid], self.baseline_code)
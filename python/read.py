@@ -1,12 +1,283 @@
 """Read data from a .csv file and return a pandas dataframe"""
 
+import os
+import glob
+import json
+import inspect
+import shutil
+import hashlib
+import functools
+import contextlib
+import numpy as np
 import pandas as pd
-import StringIO
 
-def read(file_name):
+# parsed tables are kept here as binary pickles so that later runs can
+# skip parsing the raw ADNI csv files
+CACHE_DIR = os.environ.get('ADNI_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'),
+                                        '.cache', 'adni'))
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Write a file or directory under a temporary name, and move it to path
+    once the with block is done, so that an interrupted run never leaves
+    a truncated file behind
+
+        with atomic_path(path) as tmp, open(tmp, 'wb') as handle:
+            np.save(handle, array)
+
+    Keyword Arguments:
+    path -- The file or directory to write
+    """
+    tmp = path + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    yield tmp
+    if os.path.isdir(path):
+        # a directory stored meanwhile by another process
+        shutil.rmtree(tmp)
+    else:
+        os.rename(tmp, path)
+
+def fingerprint(file_name):
+    """
+    Keyword Arguments:
+    file_name -- the source file to fingerprint
+
+    Returns a hex digest of the absolute path, size and modification
+    time of file_name. A new release of the file changes the digest.
+    """
+    stat = os.stat(file_name)
+    key = '%s:%d:%d'%(os.path.abspath(file_name), stat.st_size,
+                      int(stat.st_mtime))
+    return hashlib.md5(key).hexdigest()
+
+def cache_path(file_name, digest):
+    """
+    Keyword Arguments:
+    file_name -- the source file
+    digest    -- fingerprint of the source file
+
+    Returns the location of the cached copy of file_name
+    """
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(CACHE_DIR, '%s-%s.pkl'%(base, digest))
+
+def clear_stale(file_name, digest):
+    """
+    Remove cached copies of file_name built from older releases
+
+    Keyword Arguments:
+    file_name -- the source file
+    digest    -- fingerprint of the current release
+    """
+    current = cache_path(file_name, digest)
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    for path in glob.glob(os.path.join(CACHE_DIR, base+'-*.pkl')):
+        if path != current:
+            os.remove(path)
+
+# number of bytes pulled from the raw file at a time
+BLOCK_SIZE = 1 << 20
+
+class NulFilter(object):
+    """
+    File-like wrapper that drops the NUL bytes found in some ADNI exports
+    while the file is being read, one block at a time, so that the raw
+    contents never have to be held in memory.
+    """
+    def __init__(self, handle, block_size=BLOCK_SIZE):
+        """
+        Keyword Arguments:
+        handle     -- the open file to filter
+        block_size -- bytes to read when no size is requested
+        """
+        self.handle = handle
+        self.block_size = block_size
+
+    def read(self, size=-1):
+        """
+        Keyword Arguments:
+        size -- maximum number of bytes to return (-1 for the rest)
+        """
+        if size is None or size < 0:
+            return ''.join(iter(lambda: self.read(self.block_size), ''))
+        while True:
+            block = self.handle.read(size)
+            if not block:
+                return block
+            block = block.replace('\x00', '')
+            # an all-NUL block must not be mistaken for the end of file
+            if block:
+                return block
+
+    def readline(self):
+        """
+        Return the next line with NUL bytes removed
+        """
+        return self.handle.readline().replace('\x00', '')
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """
+        Return the next line, for parsers that iterate over the file
+        """
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        """
+        Close the wrapped file
+        """
+        self.handle.close()
+
+def parse(file_name):
+    """
+    Keyword Arguments:
+    file_name -- read the contents of file_name into a dataframe
+    """
+    with open(file_name) as handle:
+        return pd.read_csv(NulFilter(handle))
+
+def iter_chunks(file_name, chunksize):
+    """
+    Yield the contents of file_name as dataframes of at most chunksize
+    rows, keeping only one chunk in memory at a time
+
+    Keyword Arguments:
+    file_name -- the file to read
+    chunksize -- number of rows in each chunk
+    """
+    with open(file_name) as handle:
+        for chunk in pd.read_csv(NulFilter(handle), chunksize=chunksize):
+            yield chunk
+
+def read(file_name, use_cache=True, chunksize=None):
     """
     Keyword Arguments:
     file_name -- read the contents of file_name into a dataframe
+    use_cache -- load/store the parsed table in CACHE_DIR
+    chunksize -- if given, return an iterator over dataframes of this
+                 many rows instead (the cache is not used)
+    """
+    if chunksize is not None:
+        return iter_chunks(file_name, chunksize)
+    if not use_cache:
+        return parse(file_name)
+
+    digest = fingerprint(file_name)
+    path = cache_path(file_name, digest)
+    if os.path.exists(path):
+        print 'Cache hit: %s'%os.path.basename(file_name)
+        return pd.read_pickle(path)
+
+    print 'Cache miss: %s'%os.path.basename(file_name)
+    data = parse(file_name)
+    try:
+        os.makedirs(CACHE_DIR)
+    except OSError:
+        # made meanwhile, e.g. by a loader thread
+        if not os.path.isdir(CACHE_DIR):
+            raise
+    clear_stale(file_name, digest)
+    with atomic_path(path) as tmp:
+        data.to_pickle(tmp)
+
+    return data
+
+def memoize(func):
+    """
+    Build the table returned by func the first time it is asked for with
+    a given set of arguments, and hand back the same object afterwards.
+    Call func.clear() to force a rebuild.
+
+    Keyword Arguments:
+    func -- function that loads/derives a table from hashable arguments
+    """
+    cache = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # the same call by position, keyword or default gives one key
+        key = tuple(sorted(inspect.getcallargs(func, *args,
+                                               **kwargs).items()))
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        return cache[key]
+
+    wrapper.clear = cache.clear
+    return wrapper
+
+def load_arrays(path):
+    """
+    Keyword Arguments:
+    path -- Directory written by cache_arrays
+
+    Returns the arrays stored in path, as read-only memory maps
+    """
+    with open(os.path.join(path, 'meta.json')) as handle:
+        meta = json.load(handle)
+    return tuple(np.load(os.path.join(path, '%d.npy'%i), mmap_mode='r')
+                 for i in xrange(meta['count']))
+
+def save_arrays(path, arrays, meta):
+    """
+    Keyword Arguments:
+    path   -- Directory to store the arrays in
+    arrays -- Tuple of numpy arrays
+    meta   -- dict describing the arrays, stored with them
     """
-    return pd.read_csv(StringIO.StringIO(open(file_name)
-                                         .read().replace('\x00', '')))
+    with atomic_path(path) as tmp:
+        os.makedirs(tmp)
+        for i, array in enumerate(arrays):
+            np.save(os.path.join(tmp, '%d.npy'%i), array)
+        meta = dict(meta, count=len(arrays))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle, indent=1, sort_keys=True)
+
+def cache_arrays(name, sources):
+    """
+    Decorator that stores the arrays returned by the decorated function in
+    CACHE_DIR as .npy files, and hands back read-only memory maps of them
+    on later calls, so that worker processes share the pages. The files
+    are keyed on the fingerprints of the source files and the arguments of
+    the decorated function; pass use_cache=False to rebuild them.
+
+    Keyword Arguments:
+    name    -- Name of the cached arrays
+    sources -- The files the arrays are derived from
+    """
+    def decorator(func):
+        """
+        Keyword Arguments:
+        func -- function returning a tuple of numpy arrays
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            use_cache = kwargs.pop('use_cache', True)
+            if not use_cache:
+                return func(*args, **kwargs)
+
+            # the same call by position, keyword or default gives one key
+            params = repr(tuple(sorted(inspect.getcallargs(func, *args,
+                                                           **kwargs).items())))
+            key = ':'.join([params] + [fingerprint(source)
+                                       for source in sources])
+            path = os.path.join(CACHE_DIR, '%s-%s'%(
+                name, hashlib.md5(key).hexdigest()))
+            if os.path.exists(os.path.join(path, 'meta.json')):
+                print 'Cache hit: %s'%name
+                return load_arrays(path)
+
+            print 'Cache miss: %s'%name
+            save_arrays(path, func(*args, **kwargs),
+                        {'name':name, 'params':params, 'sources':sources})
+            return load_arrays(path)
+
+        return wrapper
+    return decorator
@@ -1,14 +1,27 @@
 """Read in data from clinical tests"""
 
-from read import read
+from read import read, memoize
+from patient_info import clean_visits
+from schema import compact
+import schema
 
 BASE_DIR = '/phobos/alzheimers/adni/'
 
 MMSE_FILE = BASE_DIR + 'MMSE.csv'
 CDR_FILE = BASE_DIR + 'CDR.csv'
 
-MMSE = read(MMSE_FILE)
-CDR = read(CDR_FILE)
+@memoize
+def get_mmse():
+    """
+    Mini-Mental State Examination scores
+    """
+    return compact(clean_visits(read(MMSE_FILE), inplace=True,
+                                screening=True), schema.MMSE)
 
-MMSE.loc[MMSE['VISCODE2'] == 'sc', 'VISCODE2'] = 'bl'
-CDR.loc[CDR['VISCODE2'] == 'sc', 'VISCODE2'] = 'bl'
+@memoize
+def get_cdr():
+    """
+    Clinical Dementia Rating scores
+    """
+    return compact(clean_visits(read(CDR_FILE), inplace=True,
+                                screening=True), schema.CDR)
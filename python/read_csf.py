@@ -1,8 +1,10 @@
 """Read and clean the CSF data"""
 
 import pandas as pd
-from read import read
+from read import read, memoize
 from patient_info import clean_visits
+from schema import compact
+import schema
 
 BASE_DIR = '/phobos/alzheimers/adni/'
 
@@ -10,6 +12,16 @@ CSF_FILES = ['UPENNBIOMK.csv', 'UPENNBIOMK2.csv', 'UPENNBIOMK3.csv',
              'UPENNBIOMK4_09_06_12.csv', 'UPENNBIOMK5_10_31_13.csv',
              'UPENNBIOMK6_07_02_13.csv', 'UPENNBIOMK7.csv']
 
+@memoize
+def get_csf_file(csf_file):
+    """
+    Keyword Arguments:
+    csf_file -- One of CSF_FILES
+
+    CSF results of one UPENN file
+    """
+    return read(BASE_DIR+csf_file)
+
 def read_csf():
     """
     Read in CSF results from each file and concatenate them into a
@@ -17,13 +29,13 @@ def read_csf():
     """
     data = []
     for csf_file in CSF_FILES:
-        data.append(read(BASE_DIR+csf_file))
+        data.append(get_csf_file(csf_file))
 
     return pd.concat(data, ignore_index=True)
 
-CSF = read_csf()
-
-if 'VISCODE2' in CSF.columns:
-    CSF = clean_visits(CSF)
-else:
-    CSF['VISCODE2'] = CSF['VISCODE']
+@memoize
+def get_csf():
+    """
+    CSF results from all the UPENN files, with visit codes cleaned
+    """
+    return compact(clean_visits(read_csf(), inplace=True), schema.CSF)
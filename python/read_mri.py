@@ -1,8 +1,10 @@
 """Read and clean the UCSF Free-surfer data"""
 
 import pandas as pd
-from read import read
+from read import read, memoize
 from patient_info import clean_visits
+from schema import compact
+import schema
 
 BASE_DIR = '/phobos/alzheimers/adni/'
 
@@ -14,18 +16,20 @@ DATA_51_FILE = BASE_DIR + 'UCSFFSX51_08_01_14.csv'
 DICTIONARY_FILE = BASE_DIR + 'UCSFFSX_DICT_08_01_14.csv'
 DATA_FILE = BASE_DIR + 'UCSFFSX_08_01_14.csv'
 
-FSX_51 = read(DATA_51_FILE)
-FSX = read(DATA_FILE)
-
-if 'VISCODE2' in FSX.columns:
-    FSX = clean_visits(FSX)
-else:
-    FSX['VISCODE2'] = FSX['VISCODE']
+@memoize
+def get_fsx():
+    """
+    Freesurfer data for ADNI1
+    """
+    return compact(clean_visits(read(DATA_FILE), inplace=True), schema.FSX)
 
-if 'VISCODE2' in FSX_51.columns:
-    FSX_51 = clean_visits(FSX_51)
-else:
-    FSX_51['VISCODE2'] = FSX_51['VISCODE']
+@memoize
+def get_fsx_51():
+    """
+    Freesurfer 5.1 data for ADNIGO/2
+    """
+    return compact(clean_visits(read(DATA_51_FILE), inplace=True),
+                   schema.FSX)
 
 def find_unique(src, target):
     """
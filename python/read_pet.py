@@ -1,78 +1,106 @@
 """Read and clean the UCSF Free-surfer data"""
 
 import pandas as pd
-from read import read
+from read import read, memoize
 from patient_info import clean_visits
 import numpy as np
 import matplotlib.pyplot as plt
 from patient_info import get_dx, get_baseline_classes, get_dx_with_time
-from read_clinical import MMSE, CDR
+from read_clinical import get_mmse, get_cdr
+from patient_store import PatientStore
+from schema import compact
+import schema
 
 BASE_DIR = '/phobos/alzheimers/adni/'
 
 FDG_FILE = BASE_DIR + 'UCBERKELEYFDG_03_13_14.csv'
 AV_FILE = BASE_DIR + 'UCBERKELEYAV45_07_30_14.csv'
 
-FDG = read(FDG_FILE)
-AV = read(AV_FILE)
-FDG['ROI'] = FDG['ROINAME'] + '_' + FDG['ROILAT']
+# flattened FDG data with clinical scores, as read by matlab/getPetData.m
+PET_FLAT_FILE = BASE_DIR + 'pet_mmse_cdr_convtime.csv'
 
-if 'VISCODE2' in FDG.columns:
-    FDG = clean_visits(FDG)
-else:
-    FDG['VISCODE2'] = FDG['VISCODE']
+@memoize
+def get_fdg():
+    """
+    FDG-PET readings, one row per region of interest for every visit
+    """
+    fdg = read(FDG_FILE)
+    fdg['ROI'] = fdg['ROINAME'] + '_' + fdg['ROILAT']
+    return compact(clean_visits(fdg, inplace=True), schema.FDG)
+
+def iter_fdg_dx(chunksize=100000, days=False):
+    """
+    Yield the FDG readings with their diagnosis and time to conversion,
+    chunksize rows of the raw file at a time, without loading the whole
+    table
 
-if 'VISCODE2' in AV.columns:
-    AV = clean_visits(AV)
-else:
-    AV['VISCODE2'] = AV['VISCODE']
+    Keyword Arguments:
+    chunksize -- Number of rows in each chunk
+    days      -- Measure the time to conversion in days instead of months
+    """
+    for fdg in read(FDG_FILE, chunksize=chunksize):
+        fdg['ROI'] = fdg['ROINAME'] + '_' + fdg['ROILAT']
+        yield get_dx_with_time(clean_visits(fdg, inplace=True), days)
+
+@memoize
+def get_av():
+    """
+    AV45 amyloid PET readings
+    """
+    return compact(clean_visits(read(AV_FILE), inplace=True), schema.AV)
 
-def flatten_pet():
+def flatten_pet(out_file=None):
     """
     Reshape FDG data so that each row represents a visit rather than a
     region. Records are sorted by RID, with the VISCODE2 used to break
     ties within patients.
 
+    Keyword Arguments:
+    out_file -- Also write the result to this csv file (e.g. PET_FLAT_FILE)
     """
-    fdg = get_dx_with_time(FDG)
+    fdg = get_dx_with_time(get_fdg())
 
     # add MMSE scores (aggregate only)
-    fdg = fdg.merge(MMSE[['RID', 'VISCODE2', 'MMSCORE']],
+    fdg = fdg.merge(get_mmse()[['RID', 'VISCODE2', 'MMSCORE']],
                     on=['RID', 'VISCODE2'],
                     how='inner')
     # add CDR scores (global score only)
-    fdg = fdg.merge(CDR[['RID', 'VISCODE2', 'CDGLOBAL']],
+    fdg = fdg.merge(get_cdr()[['RID', 'VISCODE2', 'CDGLOBAL']],
                     on=['RID', 'VISCODE2'],
                     how='inner')
-
-    data = []
+    schema.as_object(fdg, ['VISCODE2', 'ROI'])
 
     visit_features = ['RID', 'VISCODE2', 'DX']
     features = ['MEAN', 'MEDIAN', 'MODE', 'MIN', 'MAX', 'STDEV']
-    regions = np.sort(fdg[:5]['ROI'].unique())
-
-    grouped = fdg.groupby(visit_features, as_index=False)
-    idx = sorted(grouped.indices.keys())
-
-    for vis in idx:
-        visit = grouped.get_group(vis).sort('ROI')
-        data.append(list(vis) + # RID, VISCODE2, DX
-                    [visit['CONVTIME'].values[0]] +
-                    [visit['MMSCORE'].values[0]] +
-                    [visit['CDGLOBAL'].values[0]] +
-                    visit[features].values.flatten().tolist())
-
-    columns = visit_features + ['CONVTIME', 'MMSCORE', 'CDGLOBAL']
-    for roi in regions:
-        columns.extend([roi+'_'+feature for feature in features])
-
-    data = pd.DataFrame(data, columns=columns)
+    regions = np.sort(fdg['ROI'].unique())
+
+    # every visit must have exactly one reading for each region
+    grouped = fdg.groupby(visit_features)
+    readings = grouped['ROI'].agg(['count', 'nunique'])
+    bad = ((readings['count'] != len(regions)) |
+           (readings['nunique'] != len(regions)))
+    assert (not bad.any()),\
+        '%d visits do not have one reading for each of the %d regions'\
+        %(bad.sum(), len(regions))
+
+    # one column per (region, feature), regions outermost
+    wide = fdg.set_index(visit_features + ['ROI'])[features].unstack('ROI')
+    wide = wide.swaplevel(0, 1, axis=1)
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([regions,
+                                                            features]))
+    wide.columns = [roi+'_'+feature for roi, feature in wide.columns]
+
+    data = grouped[['CONVTIME', 'MMSCORE', 'CDGLOBAL']].first().join(wide)
+    data = data.reset_index()
 
     # data.loc[(data['DX'] == 'MCI') & (data['CONVTIME'] > 0), 'DX'] = 'MCI-C'
     # data.loc[(data['DX'] == 'MCI') & (data['CONVTIME'] == -1), 'DX'] = 'MCI-NC'
     # data.loc[(data['DX'] == 'NL') & (data['CONVTIME'] > 0), 'DX'] = 'NL-C'
     # data.loc[(data['DX'] == 'NL') & (data['CONVTIME'] == -1), 'DX'] = 'NL-NC'
 
+    if out_file is not None:
+        data.to_csv(out_file, index=False)
+
     return data
 
 def average_pet_features():
@@ -81,15 +109,14 @@ def average_pet_features():
     mean of every feature across all regions
 
     """
-    fdg = get_dx(FDG)
+    fdg = schema.as_object(get_dx(get_fdg()), ['VISCODE2'])
     grouped = fdg.groupby(['RID', 'VISCODE2', 'DX'], as_index=False)
     agg = grouped.aggregate(np.mean)
 
     visit_features = ['RID', 'VISCODE2', 'DX']
     features = ['MEAN', 'MEDIAN', 'MODE', 'MIN', 'MAX', 'STDEV']
     base_dx = get_baseline_classes(agg)
-    res = agg.RID.apply(lambda x: base_dx[x] == 'MCI-C')
-    agg['CONV'] = res
+    agg['CONV'] = (base_dx.reindex(agg['RID']) == 'MCI-C').values
     agg.loc[(agg['DX'] == 'MCI') & (agg['CONV']), 'DX'] = 'MCI-C'
     agg.loc[(agg['DX'] == 'MCI') & (~agg['CONV']), 'DX'] = 'MCI-NC'
 
@@ -100,24 +127,27 @@ def plot_features():
     Show the distribution of the features given the diagnoisis
     """
     features = ['MEAN', 'MEDIAN', 'MODE', 'MIN', 'MAX', 'STDEV']
-    regions = FDG['ROI'].unique()
-    rid = FDG['RID'].unique()
-    dx_base = get_baseline_classes(FDG)
-    groups = list(set(dx_base.values()))
+    fdg = get_fdg()
+    dx_base = get_baseline_classes(fdg)
+    groups = list(dx_base.unique())
+    store = PatientStore(fdg)
+
+    # visits are sorted by code within a patient, so the rows of the first
+    # visit of every patient are those with the code of its first row
+    codes = store.data['VISCODE2'].cat.codes.values
+    _, first_row, num_rows = np.unique(store.rid, return_index=True,
+                                       return_counts=True)
+    first = codes == np.repeat(codes[first_row], num_rows)
+    means = store.data[features].iloc[first]\
+                 .groupby(store.rid[first]).mean()
+    labels = dx_base.reindex(means.index).values
 
     stats = {}
     for feature in features:
         stats[feature] = {}
         for group in groups:
-            stats[feature][group] = []
-
-    for patient in rid:
-        if patient in dx_base:
-            patient_info = FDG[FDG['RID'] == patient]
-            visit = np.sort(patient_info['VISCODE2'].unique())[0]
-            info = patient_info[patient_info['VISCODE2'] == visit]
-            for feature in features:
-                stats[feature][dx_base[patient]].append(info[feature].mean())
+            stats[feature][group] = list(means[feature].values[labels ==
+                                                               group])
 
     for feature in features:
         if 'MCI-REV' in stats[feature]:
@@ -0,0 +1,199 @@
+"""
+Checkpointed runs of a grid of experiments (task, modality, C, job, ...)
+
+Every cell of the grid is a unit of work whose result is stored on disk
+under a digest of its settings and of the data it runs on. Cells already
+stored are skipped when a run is restarted, and the grid can be split in
+shards that run on separate machines, writing to separate directories
+that are merged afterwards.
+
+"""
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+import numpy as np
+
+from read import atomic_path
+
+# results are written below the working directory, next to the plots
+RESULTS_DIR = 'results'
+
+def data_digest(*arrays):
+    """
+    Keyword Arguments:
+    arrays -- The arrays a cell runs on (e.g. features and labels)
+
+    Returns a hex digest of the contents, dtype and shape of the arrays
+    """
+    digest = hashlib.md5()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update('%s:%s'%(array.dtype.str, array.shape))
+        digest.update(array.view(np.uint8))
+    return digest.hexdigest()
+
+def cell_key(config, digest):
+    """
+    Keyword Arguments:
+    config -- Settings of the cell (JSON serialisable dict)
+    digest -- data_digest of the data of the cell
+
+    Returns the name of the result of the cell
+    """
+    text = json.dumps(config, sort_keys=True)
+    return hashlib.md5(text + ':' + digest).hexdigest()
+
+class Scheduler(object):
+    """
+    The cells of a grid, the shard of them run by this process, and
+    their results on disk
+    """
+    def __init__(self, directory=RESULTS_DIR, shard=0, num_shards=1):
+        """
+        Keyword Arguments:
+        directory  -- Where the results are stored
+        shard      -- The shard run by this process (0 to num_shards-1)
+        num_shards -- Number of shards the grid is split in
+        """
+        assert 0 <= shard < num_shards, "No shard %d of %d"%(shard,
+                                                             num_shards)
+        self.directory = directory
+        self.shard = shard
+        self.num_shards = num_shards
+        self.cells = []
+
+    def add(self, config, digest):
+        """
+        Keyword Arguments:
+        config -- Settings of the cell (JSON serialisable dict)
+        digest -- data_digest of the data of the cell
+
+        Adds a cell to the grid and returns its key
+        """
+        key = cell_key(config, digest)
+        self.cells.append((key, config))
+        return key
+
+    def shard_of(self, key):
+        """
+        Returns the shard running the cell named key. It depends on the
+        key only, so every machine agrees on it.
+        """
+        return int(key, 16) % self.num_shards
+
+    def path(self, key):
+        """
+        Returns the file holding the result of the cell named key
+        """
+        return os.path.join(self.directory, key + '.npz')
+
+    def done(self, key):
+        """
+        Returns whether the result of the cell named key is on disk
+        """
+        return os.path.exists(self.path(key))
+
+    def save(self, key, config, result):
+        """
+        Keyword Arguments:
+        key    -- Name of the cell
+        config -- Settings of the cell, stored with the result
+        result -- dict of arrays
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        arrays = dict((name, np.asarray(value))
+                      for name, value in result.items())
+        arrays['config'] = np.array(json.dumps(config, sort_keys=True))
+        with atomic_path(self.path(key)) as tmp, open(tmp, 'wb') as handle:
+            np.savez(handle, **arrays)
+
+    def load(self, key):
+        """
+        Returns the result of the cell named key, with its settings under
+        'config'
+        """
+        with np.load(self.path(key)) as stored:
+            result = dict((name, stored[name]) for name in stored.files)
+        result['config'] = json.loads(str(result['config']))
+        return result
+
+    def write_manifest(self, path=None):
+        """
+        Keyword Arguments:
+        path -- Where to write the manifest (default: manifest.json in the
+                results directory)
+
+        Writes the key, shard and settings of every cell of the grid
+        """
+        if path is None:
+            path = os.path.join(self.directory, 'manifest.json')
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        manifest = {'num_shards':self.num_shards,
+                    'cells':[{'key':key, 'shard':self.shard_of(key),
+                              'config':config}
+                             for key, config in self.cells]}
+        with open(path, 'w') as handle:
+            json.dump(manifest, handle, indent=1, sort_keys=True)
+        return path
+
+    def run(self, func):
+        """
+        Run the cells of this shard that have no result yet
+
+        Keyword Arguments:
+        func -- Called with the settings of a cell, returns its result as
+                a dict of arrays
+        """
+        mine = [(key, config) for key, config in self.cells
+                if self.shard_of(key) == self.shard]
+        todo = [(key, config) for key, config in mine if not self.done(key)]
+        print "Shard %d/%d: %d cells, %d already done"%(
+            self.shard+1, self.num_shards, len(mine), len(mine)-len(todo))
+        for num, (key, config) in enumerate(todo):
+            print "\nCell %d/%d: %s"%(num+1, len(todo),
+                                      json.dumps(config, sort_keys=True))
+            self.save(key, config, func(config))
+
+    def results(self):
+        """
+        Returns a list of (config, result) for every cell of the grid
+        whose result is on disk, in the order the cells were added
+        """
+        return [(config, self.load(key)) for key, config in self.cells
+                if self.done(key)]
+
+def read_manifest(path):
+    """
+    Keyword Arguments:
+    path -- A manifest written by Scheduler.write_manifest
+
+    Returns the manifest as a dict
+    """
+    with open(path) as handle:
+        return json.load(handle)
+
+def merge(directories, out_dir=RESULTS_DIR):
+    """
+    Copy the results of several shards into one directory. Results are
+    named by their contents, so a cell run twice is only copied once.
+
+    Keyword Arguments:
+    directories -- The results directories of the shards
+    out_dir     -- The directory to merge into
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    copied = 0
+    for directory in directories:
+        for path in glob.glob(os.path.join(directory, '*.npz')):
+            target = os.path.join(out_dir, os.path.basename(path))
+            if not os.path.exists(target):
+                with atomic_path(target) as tmp:
+                    shutil.copy(path, tmp)
+                copied += 1
+    print "Merged %d results into %s"%(copied, out_dir)
@@ -0,0 +1,116 @@
+"""
+Compact column types for the ADNI tables
+
+Tables are parsed with the pandas defaults: visit codes and other labels
+as object strings, RID and the diagnosis codes as int64/float64. Every
+table is converted once it is loaded and cleaned: labels to categoricals,
+RID to int32, codes to the smallest integer type holding them, and, if
+ADNI_FLOAT32 is set in the environment, measurements to float32.
+
+"""
+
+import os
+import fnmatch
+import numpy as np
+
+# store the FDG/FreeSurfer/... measurements as float32
+FLOAT32 = os.environ.get('ADNI_FLOAT32', '') not in ['', '0']
+
+# the columns identifying a visit, common to most tables
+VISIT = [('RID', 'id'), ('Phase', 'category'), ('VISCODE', 'category'),
+         ('VISCODE2', 'category')]
+
+# (column name or pattern, kind) of every table; the first match is used
+DXSUM = VISIT + [('DX*', 'code')]
+ARM = VISIT + [('ARM', 'code'), ('ENROLLED', 'code')]
+REG = VISIT + [('PTSTATUS', 'code'), ('RGCONDCT', 'code'),
+               ('RGSTATUS', 'code'), ('VISTYPE', 'code')]
+DXARM_REG = DXSUM + ARM + REG
+FDG = VISIT + [('ROINAME', 'category'), ('ROILAT', 'category'),
+               ('ROI', 'category'), ('*', 'measure')]
+AV = VISIT + [('*', 'measure')]
+FSX = VISIT + [('STATUS', 'category'), ('OVERALLQC', 'category'),
+               ('ST*', 'measure')]
+MMSE = VISIT + [('MMSCORE', 'code')]
+CDR = VISIT + [('CDGLOBAL', 'measure')]
+CSF = VISIT
+
+def smallest_int(values):
+    """
+    Keyword Arguments:
+    values -- numpy array of numbers
+
+    Returns the smallest integer type holding values, or None if they
+    are not all integers (e.g. some are missing)
+    """
+    if not len(values) or values.dtype.kind not in 'iuf':
+        return None
+    if values.dtype.kind == 'f' and \
+       not (np.isfinite(values).all() and (values == np.round(values)).all()):
+        return None
+    low, high = values.min(), values.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return None
+
+def column_kind(column, schema):
+    """
+    Returns the kind of column in schema, or None if it is not listed
+    """
+    for pattern, kind in schema:
+        if fnmatch.fnmatchcase(column, pattern):
+            return kind
+    return None
+
+def compact(data, schema):
+    """
+    Convert the columns of data, in place, to the types given by schema
+
+    Keyword Arguments:
+    data   -- The table
+    schema -- List of (column name or pattern, kind), kind being one of
+              'id'       -- int32 (kept as is if some are missing)
+              'category' -- categorical
+              'code'     -- smallest integer type, or float32 if some are
+                            missing
+              'measure'  -- float32 if FLOAT32, float columns only
+
+    Returns data
+    """
+    for column in data.columns:
+        kind = column_kind(column, schema)
+        values = data[column].values
+        if kind == 'category':
+            if data[column].dtype.name != 'category':
+                data[column] = data[column].astype('category')
+        elif kind in ['id', 'code']:
+            dtype = smallest_int(values)
+            if kind == 'id' and dtype is not None:
+                dtype = np.int32
+            if dtype is not None:
+                data[column] = values.astype(dtype)
+            elif kind == 'code' and values.dtype.kind == 'f':
+                data[column] = values.astype(np.float32)
+        elif kind == 'measure' and FLOAT32 and values.dtype.kind == 'f':
+            data[column] = values.astype(np.float32)
+    return data
+
+def as_object(data, columns=None):
+    """
+    Convert categorical columns of data back to object, in place. A
+    groupby on several keys spans every combination of the categories of
+    a categorical key, observed or not, so group on object columns.
+
+    Keyword Arguments:
+    data    -- The table
+    columns -- The columns to convert (default: all categorical columns)
+
+    Returns data
+    """
+    if columns is None:
+        columns = data.columns
+    for column in columns:
+        if data[column].dtype.name == 'category':
+            data[column] = data[column].astype(object)
+    return data
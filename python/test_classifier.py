@@ -0,0 +1,67 @@
+"""Regression tests for classifier.stream_fit against classifier.batch_fit"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+import classifier
+
+def write_features(file_name, classes, num_rows=5000, seed=0):
+    """
+    Write a features file shaped like hmm.write_viterbi_prob, with uneven
+    classes each raising the probability of one state
+    """
+    rng = np.random.RandomState(seed)
+    freq = np.arange(len(classes), 0, -1, dtype=float)
+    dx = rng.choice(classes, num_rows, p=freq/freq.sum())
+    logits = rng.randn(num_rows, len(classes) + 1)
+    logits[np.arange(num_rows), np.searchsorted(classes, dx)] += 2.0
+    prob = np.exp(logits)
+    prob /= prob.sum(axis=1)[:, None]
+    data = pd.DataFrame(prob, columns=['S%d'%(i + 1)
+                                       for i in xrange(prob.shape[1])])
+    data.insert(0, 'RID', rng.randint(0, num_rows//3, num_rows))
+    data['DX'] = dx
+    data['MMSE'] = 30
+    data['CDR'] = 0.0
+    data.to_csv(file_name, index=False)
+
+class StreamFitTest(unittest.TestCase):
+    """
+    The streamed model is scored on the same held out patients as the batch
+    one, and should be as accurate whatever the regularisation
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'features.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_accuracy(self, C):
+        _, batch = classifier.batch_fit(self.file_name, C=C)
+        _, stream = classifier.stream_fit(self.file_name, chunksize=1000,
+                                          C=C)
+        self.assertAlmostEqual(stream, batch, delta=0.02)
+
+    def test_strong_regularisation(self):
+        # the intercept is penalised as in liblinear, or the streamed model
+        # predicts the most frequent class only
+        write_features(self.file_name, [1, 2, 3])
+        self.check_accuracy(1e-3)
+
+    def test_weak_regularisation(self):
+        write_features(self.file_name, [1, 2, 3])
+        self.check_accuracy(1.0)
+
+    def test_other_classes(self):
+        write_features(self.file_name, [1, 2, 3, 4])
+        logreg, _ = classifier.stream_fit(self.file_name, chunksize=1000)
+        np.testing.assert_array_equal(logreg.classes_, [1, 2, 3, 4])
+        self.check_accuracy(1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
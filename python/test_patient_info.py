@@ -0,0 +1,39 @@
+"""Regression tests for patient_info.get_time_to_conversion"""
+
+import unittest
+import numpy as np
+import pandas as pd
+
+import patient_info as pi
+
+class TimeToConversionTest(unittest.TestCase):
+    """
+    A patient converting NL->MCI at their third visit, with one visit
+    missing its exam date
+    """
+    def setUp(self):
+        self.data = pd.DataFrame({
+            'RID':[1, 1, 1, 1, 2],
+            'EXAMDATE':['2006-01-15', '2006-07-15', '2007-01-15', None,
+                        '2006-03-01'],
+            'DXCHANGE':[1, 1, pi.NL_MCI, 1, 1]},
+                                 index=[10, 11, 12, 13, 14])
+
+    def test_months(self):
+        convtime = pi.get_time_to_conversion(self.data)
+        np.testing.assert_array_equal(convtime.values, [12, 6, -1, -1, -1])
+        self.assertEqual(list(convtime.index), list(self.data.index))
+
+    def test_days(self):
+        convtime = pi.get_time_to_conversion(self.data, days=True)
+        np.testing.assert_array_equal(convtime.values,
+                                      [365, 184, -1, -1, -1])
+
+    def test_undated_event(self):
+        # a conversion without a date cannot be measured from
+        self.data.loc[12, 'EXAMDATE'] = None
+        convtime = pi.get_time_to_conversion(self.data)
+        np.testing.assert_array_equal(convtime.values, [-1]*5)
+
+if __name__ == '__main__':
+    unittest.main()